@@ -0,0 +1,259 @@
+"""Benchmarks of the catalog, tree, export and tile code paths.
+
+Run from the repository root:
+
+    python benchmarks/bench.py --sizes 100 1000 10000 --output results.json
+
+Results are written as JSON (one record per benchmark and catalog size) so that
+runs of different versions can be compared. Tree and icon benchmarks need
+PySide2 and are skipped without it; URL and seeding benchmarks need NumPy.
+"""
+import argparse
+import base64
+import http.server
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from importlib.util import find_spec
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from com_github_kasim73_tile_services.core.TmsCatalog import normalize_catalog, load_catalog  # noqa: E402
+from com_github_kasim73_tile_services.core.TmsSearch import SearchIndex  # noqa: E402
+from com_github_kasim73_tile_services.core.TmsExport import CatalogExporter  # noqa: E402
+from com_github_kasim73_tile_services.core.TmsCache import TileCache  # noqa: E402
+from com_github_kasim73_tile_services.core.TmsService import Service  # noqa: E402
+
+
+SERVICES_PER_CATEGORY = 10
+WORDS = ['карта', 'спутник', 'гибрид', 'рельеф', 'пробки', 'схема', 'map', 'satellite', 'hybrid',
+         'terrain', 'roads', 'labels', 'night', 'dark', 'light', 'topo', 'street', 'transport']
+
+
+def make_png(width, height, seed):
+    rnd = random.Random(seed)
+    raw = b''.join(b'\x00' + bytes(rnd.getrandbits(8) for _ in range(width * 3)) for _ in range(height))
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+
+def make_catalog(size, url='http://tile[0123].example.com/{LEVEL}/{ROW}/{COL}.png'):
+    # Every category and every fourth service has its own embedded 32x32 icon
+    rnd = random.Random(size)
+    categories = []
+    images = {}
+    for c in range(max(1, size // SERVICES_PER_CATEGORY)):
+        image = 'img_cat_{}'.format(c)
+        images[image] = {'format': 'png', 'data': base64.b64encode(make_png(32, 32, c)).decode('ascii')}
+        services = []
+        for s in range(SERVICES_PER_CATEGORY):
+            name = 'service_{}_{}'.format(c, s)
+            tms = {
+                'name': name,
+                'title': ' '.join(rnd.sample(WORDS, 2)),
+                'description': '<p>{}</p><br/><a href="https://example.com/{}">©Example</a>'.format(
+                    ' '.join(rnd.choice(WORDS) for _ in range(30)), name),
+                'type': 'quadkey' if s % 3 == 0 else 'xyz',
+                'url': url.replace('{ROW}', '{QUADKEY}') if s % 3 == 0 else url,
+                'level': {'min': 0, 'max': 19}
+            }
+            if s % 4 == 0:
+                tms['image'] = 'img_{}'.format(name)
+                images[tms['image']] = {'format': 'png', 'data': base64.b64encode(make_png(32, 32, name)).decode('ascii')}
+            services.append(tms)
+        categories.append({'name': 'Category {}'.format(c), 'image': image, 'tms': services})
+    return {'services': {'category': categories}, 'images': images}
+
+
+class Bench:
+
+    def __init__(self, repeat, only) -> None:
+        self.repeat = repeat
+        self.only = only
+        self.results = []
+
+    def run(self, name, size, func, items=None, setup=None):
+        # func(state) is timed; setup() runs before every repetition and returns the state
+        if self.only and not any(o in name for o in self.only):
+            return
+        times = []
+        for _ in range(self.repeat):
+            state = setup() if setup is not None else None
+            start = time.perf_counter()
+            func(state)
+            times.append(time.perf_counter() - start)
+        record = {
+            'name': name,
+            'size': size,
+            'repeat': self.repeat,
+            'min': min(times),
+            'median': statistics.median(times),
+            'unit': 's'
+        }
+        if items:
+            record['items'] = items
+            record['items_per_sec'] = items / record['min']
+        self.results.append(record)
+        print('{:<28} {:>7} {:>10.4f} s {}'.format(name, size, record['min'],
+              '{:>12.0f} /s'.format(record['items_per_sec']) if items else ''), file=sys.stderr)
+
+
+def bench_catalog(bench, size, workdir):
+    data = make_catalog(size)
+    text = json.dumps(data, ensure_ascii=False)
+    fn = os.path.join(workdir, 'catalog_{}.json'.format(size))
+    with open(fn, 'w', encoding='UTF-8') as f:
+        f.write(text)
+    snapshot = os.path.join(workdir, 'catalog_{}.snapshot'.format(size))
+
+    bench.run('json_parse', size, lambda _: json.loads(text), size)
+    bench.run('json_parse_normalize', size, lambda _: normalize_catalog(json.loads(text)), size)
+    bench.run('load_catalog_cold', size, lambda _: load_catalog(fn, snapshot), size,
+              setup=lambda: os.path.exists(snapshot) and os.remove(snapshot))
+    load_catalog(fn, snapshot)
+    bench.run('load_catalog_snapshot', size, lambda _: load_catalog(fn, snapshot), size)
+
+    catalog = normalize_catalog(data)
+    bench.run('search_index_build', size, lambda _: SearchIndex().build(catalog), size)
+    index = SearchIndex()
+    index.build(catalog)
+    queries = ['кар', 'sat', 'hybrid night', 'service_1', 'zzz']
+    bench.run('search_query', size, lambda _: [index.search(q) for q in queries], len(queries))
+
+    services = [(cat['name'], s) for cat in catalog['categories'] for s in cat['services']]
+    out = os.path.join(workdir, 'tabs')
+    bench.run('tab_export', size, lambda _: CatalogExporter(services, out).run(), size,
+              setup=lambda: shutil.rmtree(out, ignore_errors=True))
+    return catalog
+
+
+def bench_tree(bench, size, catalog):
+    try:
+        from PySide2.QtWidgets import QApplication, QTreeWidget
+    except ImportError:
+        print('PySide2 is not available, tree benchmarks are skipped', file=sys.stderr)
+        return
+    from com_github_kasim73_tile_services.TmsTreeItems import IconCache, update_tree
+    QApplication.instance() or QApplication(['bench', '-platform', 'offscreen'])
+
+    def populate(_):
+        update_tree(QTreeWidget(), catalog, IconCache({}))
+
+    bench.run('tree_populate', size, populate, size)
+    tree = QTreeWidget()
+    icons = IconCache({})
+    update_tree(tree, catalog, icons)
+    bench.run('tree_reload_unchanged', size, lambda _: update_tree(tree, catalog, icons), size)
+
+    names = list(catalog['images'])
+
+    def decode(cache):
+        for name in names:
+            cache.get(name)
+
+    bench.run('icon_decode', size, decode, len(names), setup=lambda: IconCache(catalog['images']))
+
+
+def bench_tiles(bench, workdir, tiles):
+    if find_spec('numpy') is None:
+        print('NumPy is not available, tile benchmarks are skipped', file=sys.stderr)
+        return
+    from com_github_kasim73_tile_services.core.TmsUrl import UrlTemplate, tile_grid
+    from com_github_kasim73_tile_services.core.TmsSeed import TileSeeder
+
+    for kind in ('xyz', 'quadkey'):
+        template = UrlTemplate(Service('bench', 'http://t[0123].example.com/{LEVEL}/{ROW}/{COL}?q={QUADKEY}', kind))
+        xs, ys = tile_grid(100000, 100000, 100999, 100999)
+        bench.run('url_generate_' + kind, len(xs), lambda _: template.urls(18, xs, ys), len(xs))
+
+    cache = TileCache(os.path.join(workdir, 'cache.mbtiles'))
+    payload = os.urandom(20000)
+    # Distinct payloads, identical ones would only be counted by the content addressed cache
+    bench.run('cache_put', tiles, lambda _: [cache.put('s', 18, i, 0, payload + i.to_bytes(4, 'big'))
+                                            for i in range(tiles)], tiles)
+    bench.run('cache_get', tiles, lambda _: [cache.get('s', 18, i, 0) for i in range(tiles)], tiles)
+    cache.close()
+
+    server = start_stub_server()
+    url = 'http://127.0.0.1:{}/[ab]/{{LEVEL}}/{{ROW}}/{{COL}}.png'.format(server.server_address[1])
+    data = Service('stub', url)
+    out = os.path.join(workdir, 'seed.mbtiles')
+    # about `tiles` tiles at level 14 around Moscow
+    side = 0.022 * max(1, int(tiles ** 0.5))
+    bbox = (37.6, 55.7, 37.6 + side, 55.7 + side * 0.56)
+    count = TileSeeder(data, out).count(bbox, 14, 14)
+    bench.run('tile_download', count, lambda _: TileSeeder(data, out).run(bbox, 14, 14), count,
+              setup=lambda: os.path.exists(out) and os.remove(out))
+    server.shutdown()
+
+
+def start_stub_server():
+    payload = make_png(256, 256, 0)
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='TileServices benchmarks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000], help='catalog sizes (services)')
+    parser.add_argument('--tiles', type=int, default=1000, help='tiles for the cache and download benchmarks')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='*', help='run only benchmarks whose name contains one of these strings')
+    parser.add_argument('--output', help='json file for the results (default: stdout)')
+    args = parser.parse_args(argv)
+
+    bench = Bench(args.repeat, args.only)
+    workdir = tempfile.mkdtemp(prefix='tms_bench_')
+    try:
+        for size in args.sizes:
+            catalog = bench_catalog(bench, size, workdir)
+            bench_tree(bench, size, catalog)
+        bench_tiles(bench, workdir, args.tiles)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': bench.results
+    }
+    text = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, 'w', encoding='UTF-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+from PySide2.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem, QLabel, \
+    QPushButton, QFileDialog, QHeaderView
+from PySide2.QtCore import Qt, QTimer
+
+import threading
+import time
+
+from .core.TmsMetrics import metrics
+
+
+REFRESH_INTERVAL = 2000
+# Seconds between the counts of the tile cache deduplication, which read the whole cache
+DEDUP_INTERVAL = 60
+
+
+def format_seconds(value):
+    return '{:.3f}'.format(value) if value is not None else ''
+
+
+def format_bytes(value):
+    for unit in ('B', 'KB', 'MB'):
+        if value < 1024:
+            return '{:.0f} {}'.format(value, unit)
+        value /= 1024
+    return '{:.1f} GB'.format(value)
+
+
+class DiagnosticsDialog(QDialog):
+
+    def __init__(self, plugin, parent=None) -> None:
+        super().__init__(parent)
+        self.tr = plugin.tr
+        self.__plugin = plugin
+        self.__durations_names = [
+            ('tms_catalog_load_seconds', self.tr('Загрузка каталога')),
+            ('tms_tree_build_seconds', self.tr('Построение дерева')),
+            ('tms_catalog_download_seconds', self.tr('Обновление каталога')),
+            ('tms_layer_open_seconds', self.tr('Открытие слоя')),
+            ('tms_served_seconds', self.tr('Подготовка тайла'))
+        ]
+        self.setWindowTitle(self.tr('Диагностика'))
+        self.resize(720, 420)
+        layout = QVBoxLayout()
+
+        self.__durations = QLabel()
+        self.__durations.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        layout.addWidget(self.__durations)
+
+        self.__table = QTableWidget(0, 8)
+        self.__table.setHorizontalHeaderLabels([self.tr('Сервис'), self.tr('Запросы'), self.tr('Ошибки'),
+                                                self.tr('Объем'), self.tr('Задержка p50, с'),
+                                                self.tr('Задержка p95, с'), self.tr('Попадания в кэш'),
+                                                self.tr('Дедупликация в кэше')])
+        self.__table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.__table.setEditTriggers(QTableWidget.NoEditTriggers)
+        layout.addWidget(self.__table)
+
+        buttons = QHBoxLayout()
+        buttons.addStretch()
+        export = QPushButton(self.tr('Сохранить...'))
+        export.clicked.connect(self.__export)
+        buttons.addWidget(export)
+        close = QPushButton(self.tr('Закрыть'))
+        close.clicked.connect(self.close)
+        buttons.addWidget(close)
+        layout.addLayout(buttons)
+        self.setLayout(layout)
+
+        self.__version = None
+        self.__dedup = {}
+        self.__dedup_job = None
+        self.__dedup_started = None
+        self.__timer = QTimer(self)
+        self.__timer.setInterval(REFRESH_INTERVAL)
+        self.__timer.timeout.connect(self.__update)
+        self.__timer.start()
+        self.__update()
+
+    def __update_dedup(self):
+        # The deduplication is counted in a thread; returns True when new numbers arrived
+        if self.__dedup_job is not None:
+            thread, result = self.__dedup_job
+            if thread.is_alive():
+                return False
+            self.__dedup_job = None
+            self.__dedup = result
+            return True
+        if self.__dedup_started is None or time.monotonic() - self.__dedup_started > DEDUP_INTERVAL:
+            self.__dedup_started = time.monotonic()
+            cache = self.__plugin.tile_cache
+            result = {}
+            thread = threading.Thread(target=lambda: result.update(cache.dedup_stats()), name='TmsDedupStats',
+                                      daemon=True)
+            thread.start()
+            self.__dedup_job = (thread, result)
+        return False
+
+    def __update(self):
+        registry = metrics()
+        if not self.__update_dedup() and registry.version == self.__version:
+            return
+        self.__version = registry.version
+        lines = []
+        for name, title in self.__durations_names:
+            series = registry.series(name)
+            count = sum(h.count for _, h in series)
+            if count:
+                total = sum(h.sum for _, h in series)
+                lines.append('{}: {} × {} {}'.format(title, count, format_seconds(total / count), self.tr('с')))
+        self.__durations.setText('\n'.join(lines))
+
+        services = registry.services()
+        dedup = self.__dedup
+        for name in dedup:
+            services.setdefault(name, {'cache_hit_ratio': None})
+        self.__table.setRowCount(len(services))
+        for row, (name, s) in enumerate(sorted(services.items())):
+            ratio = s['cache_hit_ratio']
+            texts = [name, str(s.get('requests', 0)), str(s.get('errors', 0)), format_bytes(s.get('bytes', 0)),
+                     format_seconds(s.get('latency_p50')), format_seconds(s.get('latency_p95')),
+                     '{:.0%}'.format(ratio) if ratio is not None else '',
+                     '{:.2f}'.format(dedup[name]['dedup_ratio']) if name in dedup else '']
+            for column, text in enumerate(texts):
+                item = QTableWidgetItem(text)
+                if column:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.__table.setItem(row, column, item)
+
+    def __export(self):
+        fn, _ = QFileDialog.getSaveFileName(self, self.tr('Сохранение файла'), 'Metrics.json',
+                                            'JSON (*.json);;Prometheus (*.prom)')
+        if not fn:
+            return
+        if fn.lower().endswith('.prom'):
+            metrics().write(prometheus_file=fn)
+        else:
+            metrics().write(json_file=fn)
+
+    def closeEvent(self, event):
+        self.__timer.stop()
+        super().closeEvent(event)
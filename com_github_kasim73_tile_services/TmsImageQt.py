@@ -0,0 +1,26 @@
+from PySide2.QtGui import QImage
+from PySide2.QtCore import QBuffer, QIODevice
+
+
+def decode_qimage(data):
+    # Tile decoder for core.TmsImage; QImage is safe to use outside of the GUI thread
+    import numpy as np
+    image = QImage.fromData(data)
+    if image.isNull():
+        raise ValueError('Unsupported tile image')
+    image = image.convertToFormat(QImage.Format_RGBA8888)
+    width, height = image.width(), image.height()
+    buffer = np.frombuffer(image.constBits(), dtype=np.uint8, count=image.bytesPerLine() * height)
+    return buffer.reshape(height, image.bytesPerLine())[:, :width * 4].reshape(height, width, 4).copy()
+
+
+def encode_qimage(rgba, fmt, quality):
+    # Tile encoder for core.TmsImage
+    height, width = rgba.shape[:2]
+    data = rgba.tobytes()
+    image = QImage(data, width, height, width * 4, QImage.Format_RGBA8888)
+    buffer = QBuffer()
+    buffer.open(QIODevice.WriteOnly)
+    if not image.save(buffer, fmt.upper(), quality):
+        raise ValueError('Tile image can not be encoded as {}'.format(fmt))
+    return bytes(buffer.data())
@@ -0,0 +1,145 @@
+import os
+import json
+import tempfile
+from pathlib import Path
+
+from axipy import AxiomaPlugin, Position
+from axipy.app import mainwindow, Version
+
+from PySide2.QtWidgets import QDockWidget
+from PySide2.QtGui import QIcon
+from PySide2.QtCore import Qt, Signal
+
+from .core.TmsUtils import doc_index_filename, cache_filename, metrics_filename, metrics_prometheus_filename, \
+    gateway_filename
+from .core.TmsMetrics import metrics, MetricsWriter
+
+
+class DockWidget(QDockWidget):
+
+    closeWidget = Signal()
+
+    def __init__(self, name) -> None:
+        super().__init__(name)
+
+    def closeEvent(self, event):
+        self.closeWidget.emit()
+        super().closeEvent(event)
+
+
+class Plugin(AxiomaPlugin):
+    def load(self):
+        self.__icon = QIcon(self.local_file('tms_icon.svg'))
+        self.__button = self.create_action(
+            self.tr('Карты из Интернета'),
+            icon = self.__icon,
+            on_click = self.show_widget,
+            tooltip = self.tr('Добавление слоя из каталога Интернет-карт'),
+            doc_file = doc_index_filename(self.language))
+        self.__button.action.setCheckable(True)
+        position = Position(self.tr('Основные'), self.tr('Команды'))
+        position.add(self.__button)
+        self.__dock = None
+        self.__tile_cache = None
+        self.__prefetcher = None
+        self.__tile_server = None
+        self.__gateway = False
+        # Metrics files for monitoring, rewritten while the plugin is in use
+        self.__metrics_writer = MetricsWriter(metrics(), self.data_file(metrics_filename()),
+                                              self.data_file(metrics_prometheus_filename()))
+
+    def data_file(self, file_name):
+        # Writable location for the plugin caches
+        if (Version.segments()[0] >= 4):
+            Path(self.user_plugin_data_dir()).mkdir(parents=True, exist_ok=True)
+            return self.user_plugin_data_dir(file_name)
+        return os.path.join(tempfile.gettempdir(), file_name)
+
+    @property
+    def tile_cache(self):
+        if self.__tile_cache is None:
+            from .core.TmsCache import TileCache
+            self.__tile_cache = TileCache(self.data_file(cache_filename()))
+        return self.__tile_cache
+
+    @property
+    def tile_server(self):
+        # Local HTTP server for the tiles produced by the plugin, e.g. composite services
+        if self.__tile_server is None:
+            from .core.TmsServer import TileServer
+            from .core.TmsImage import set_decoder, set_encoder
+            from .TmsImageQt import decode_qimage, encode_qimage
+            set_decoder(decode_qimage)
+            set_encoder(encode_qimage)
+            self.__tile_server = TileServer()
+        return self.__tile_server
+
+    @property
+    def gateway(self):
+        # Client of the shared tile gateway of the machine (see TmsGateway), None when it is not configured.
+        # The gateway address is taken from the TILE_SERVICES_GATEWAY environment variable or Gateway.json.
+        if self.__gateway is False:
+            url = os.environ.get('TILE_SERVICES_GATEWAY')
+            config = self.data_file(gateway_filename())
+            if not url and os.path.isfile(config):
+                try:
+                    with open(config, 'r', encoding='UTF-8') as f:
+                        url = json.load(f).get('url')
+                except (OSError, ValueError) as error:
+                    print('{}: {}'.format(config, error))
+            if url:
+                from .core.TmsGateway import GatewayClient
+                self.__gateway = GatewayClient(url)
+            else:
+                self.__gateway = None
+        return self.__gateway
+
+    def register_service(self, data, source):
+        # Catalog layers served by the tile server get their neighbouring tiles prefetched into the tile cache
+        if self.__prefetcher is None:
+            from .TmsPrefetcher import ViewPrefetcher
+            self.__prefetcher = ViewPrefetcher(self.tile_cache)
+        self.__prefetcher.register(data, source)
+
+    def __remove_dock(self):
+        if self.__dock is not None:
+            self.__dock.widget().stop()
+            self.__dock.close()
+            self.__dock = None
+
+    def unload(self):
+        self.__remove_dock()
+        self.__button.remove()
+        if self.__prefetcher is not None:
+            self.__prefetcher.stop()
+            self.__prefetcher = None
+        if self.__tile_server is not None:
+            self.__tile_server.stop()
+            self.__tile_server = None
+        if self.__tile_cache is not None:
+            self.__tile_cache.close()
+            self.__tile_cache = None
+        self.__metrics_writer.stop()
+
+    def __close_dock(self):
+        self.__button.action.setChecked(False)
+        self.__remove_dock()
+
+    def show_widget(self):
+        if self.__dock is None:
+            # The widget and its catalog, probing and export modules are imported on the first use
+            from .TmsWidget import TmsWidget
+            title = self.tr('Карты из Интернета')
+            self.__dock = DockWidget(title)
+            self.__dock.setAttribute(Qt.WA_DeleteOnClose)
+            w = TmsWidget(self)
+            w.setWindowTitle(title)
+            self.__dock.setWidget(w)
+            self.__dock.setAllowedAreas(Qt.LeftDockWidgetArea | Qt.RightDockWidgetArea)
+            if (Version.segments()[0] >= 4):
+                mainwindow.add_dock_widget(self.__dock, Qt.RightDockWidgetArea, self.__icon)
+            else:
+                mainwindow.add_dock_widget(self.__dock, Qt.RightDockWidgetArea)
+            self.__dock.closeWidget.connect(self.__close_dock)
+        else:
+            self.__remove_dock()
@@ -0,0 +1,86 @@
+from PySide2.QtCore import QObject, QTimer, QRectF
+
+from axipy import view_manager, CoordSystem, CoordTransformer
+
+from .core.TmsPrefetch import Prefetcher, level_for_view, prefetch_tiles
+
+
+class ViewPrefetcher(QObject):
+    """Prefetches tiles around the active map view for the catalog layers on it.
+
+    The view is polled, because the extent is changed by the host without a
+    signal available to plugins; the prefetch starts once the extent has been
+    stable for one poll interval.
+    """
+
+    POLL_INTERVAL = 500
+
+    def __init__(self, cache) -> None:
+        super().__init__()
+        self.__services = {}
+        self.__prefetcher = Prefetcher(cache)
+        self.__mercator = CoordSystem.from_epsg(3857)
+        self.__pending = None
+        self.__requested = None
+        self.__timer = QTimer(self)
+        self.__timer.setInterval(self.POLL_INTERVAL)
+        self.__timer.timeout.connect(self.__poll)
+        view_manager.count_changed.connect(self.__views_changed)
+        self.__views_changed()
+
+    def register(self, data, source):
+        # Services opened from the catalog with the tile server source of their layer,
+        # the raster name is the service name
+        self.__services[data.name] = (data, source)
+        self.__views_changed()
+
+    def stop(self):
+        self.__timer.stop()
+        view_manager.count_changed.disconnect(self.__views_changed)
+        self.__prefetcher.stop()
+
+    def __views_changed(self):
+        if self.__services and view_manager.mapviews:
+            self.__timer.start()
+        else:
+            self.__timer.stop()
+            self.__prefetcher.cancel()
+
+    def __view_services(self, view):
+        services = []
+        for layer in view.map.layers:
+            name = getattr(layer.data_object, 'name', None)
+            if name in self.__services:
+                services.append(self.__services[name])
+        return services
+
+    def __mercator_rect(self, view):
+        rect = view.camera.rect
+        if view.coordsystem != self.__mercator:
+            rect = CoordTransformer(view.coordsystem, self.__mercator).transform(rect)
+        return QRectF(rect)
+
+    def __poll(self):
+        view = view_manager.active
+        if view is None or not hasattr(view, 'map'):
+            return
+        services = self.__view_services(view)
+        if not services:
+            return
+        try:
+            rect = self.__mercator_rect(view)
+        except Exception:
+            return
+        state = (rect.left(), rect.top(), rect.right(), rect.bottom(), view.widget.width(),
+                 tuple(data.name for data, _ in services))
+        if state != self.__pending:
+            # Still moving, whatever was queued for the old extent is stale
+            self.__pending = state
+            self.__prefetcher.cancel()
+            return
+        if state == self.__requested:
+            return
+        self.__requested = state
+        bbox = state[:4]
+        self.__prefetcher.request([(source, prefetch_tiles(bbox, level_for_view(rect.width(), state[4], data), data))
+                                   for data, source in services])
@@ -0,0 +1,148 @@
+from PySide2.QtWidgets import QTreeWidgetItem
+from PySide2.QtGui import QImage, QPixmap, QPainter, QColor
+from PySide2.QtCore import Qt, QByteArray
+
+
+class IconCache:
+
+    def __init__(self, images) -> None:
+        self.__images = images
+        self.__pixmaps = {}
+        self.__badged = {}
+
+    def update(self, images):
+        for name in list(self.__pixmaps):
+            if images.get(name) != self.__images.get(name):
+                del self.__pixmaps[name]
+        for key in list(self.__badged):
+            if images.get(key[0]) != self.__images.get(key[0]):
+                del self.__badged[key]
+        self.__images = images
+
+    def get(self, name):
+        # Each image is decoded once, the first time an item using it is painted
+        if name not in self.__pixmaps:
+            px = None
+            if name in self.__images:
+                im = self.__images[name]
+                by = QByteArray.fromBase64(im['data'].encode('ascii'))
+                px = QPixmap.fromImage(QImage.fromData(by, im['format']))
+                if px.isNull():
+                    px = None
+            self.__pixmaps[name] = px
+        return self.__pixmaps[name]
+
+    def badge(self, color):
+        key = '#badge:' + color
+        if key not in self.__pixmaps:
+            px = QPixmap(16, 16)
+            px.fill(Qt.transparent)
+            painter = QPainter(px)
+            painter.setRenderHint(QPainter.Antialiasing)
+            painter.setPen(Qt.NoPen)
+            painter.setBrush(QColor(color))
+            painter.drawEllipse(4, 4, 8, 8)
+            painter.end()
+            self.__pixmaps[key] = px
+        return self.__pixmaps[key]
+
+    def badged(self, name, color):
+        # The icon with the badge drawn over its bottom right corner
+        key = (name, color)
+        if key not in self.__badged:
+            px = self.get(name)
+            if px is not None:
+                px = px.copy()
+                size = max(6, min(px.width(), px.height()) // 2)
+                painter = QPainter(px)
+                painter.setRenderHint(QPainter.Antialiasing)
+                painter.setPen(QColor('white'))
+                painter.setBrush(QColor(color))
+                painter.drawEllipse(px.width() - size, px.height() - size, size - 1, size - 1)
+                painter.end()
+            self.__badged[key] = px
+        return self.__badged[key]
+
+
+class CatalogItem(QTreeWidgetItem):
+
+    def __init__(self, key, image, icons, service=None) -> None:
+        super().__init__()
+        self.key = key
+        # The Service of a service item, shared with the catalog rather than copied into a QVariant
+        self.service = service
+        self.__image = image
+        self.__icons = icons
+        self.__badge = None
+
+    def set_image(self, image):
+        if image != self.__image:
+            self.__image = image
+            self.emitDataChanged()
+
+    def set_badge(self, badge):
+        if badge != self.__badge:
+            self.__badge = badge
+            self.emitDataChanged()
+
+    def data(self, column, role):
+        if role == Qt.DecorationRole and column == 0:
+            px = self.__icons.get(self.__image) if self.__image is not None else None
+            if self.__badge is not None:
+                if px is not None:
+                    px = self.__icons.badged(self.__image, self.__badge)
+                else:
+                    px = self.__icons.badge(self.__badge)
+            if px is not None:
+                return px
+        return super().data(column, role)
+
+
+def update_tree(tree, catalog, icons):
+    # Fills the QTreeWidget from the normalized catalog. Items are matched by the category
+    # and service names, so only the changed ones are touched and the selection and
+    # expand state survive a reload
+    icons.update(catalog['images'])
+    existing = {}
+    for i in range(tree.topLevelItemCount()):
+        item = tree.topLevelItem(i)
+        existing[item.key] = item
+    for index, cat in enumerate(catalog['categories']):
+        item = existing.pop(cat['name'], None)
+        expand = item is None
+        if item is None:
+            item = CatalogItem(cat['name'], cat['image'], icons)
+            item.setText(0, cat['name'])
+            tree.insertTopLevelItem(index, item)
+        else:
+            if tree.indexOfTopLevelItem(item) != index:
+                expanded = item.isExpanded()
+                tree.takeTopLevelItem(tree.indexOfTopLevelItem(item))
+                tree.insertTopLevelItem(index, item)
+                item.setExpanded(expanded)
+            item.set_image(cat['image'])
+        _update_services(item, cat['services'], icons)
+        if expand:
+            item.setExpanded(True)
+    for item in existing.values():
+        tree.takeTopLevelItem(tree.indexOfTopLevelItem(item))
+
+
+def _update_services(cat_item, services, icons):
+    existing = {}
+    for i in range(cat_item.childCount()):
+        item = cat_item.child(i)
+        existing[item.key] = item
+    for index, data in enumerate(services):
+        item = existing.pop(data.name, None)
+        if item is None:
+            item = CatalogItem(data.name, data.image, icons)
+            cat_item.insertChild(index, item)
+        elif cat_item.indexOfChild(item) != index:
+            cat_item.insertChild(index, cat_item.takeChild(cat_item.indexOfChild(item)))
+        if item.service != data:
+            item.setText(0, data.label)
+            item.set_image(data.image)
+        item.service = data
+    for item in existing.values():
+        cat_item.removeChild(item)
@@ -1,13 +1,24 @@
-from PySide2.QtWidgets import QTreeWidget, QTreeWidgetItem, QHeaderView, QFileDialog, QMessageBox, QMenu
-from PySide2.QtGui import QImage, QPixmap, QCursor
-from PySide2.QtCore import Qt, QByteArray
-
-from .TmsUtils import json_filename, generate_tile_tab_file
+from PySide2.QtWidgets import QTreeWidget, QHeaderView, QFileDialog, QMessageBox, QMenu
+from PySide2.QtGui import QCursor
+from PySide2.QtCore import Qt
+
+from .TmsTreeItems import IconCache, update_tree
+
+from .core.TmsUtils import json_filename, snapshot_filename, catalogs_dirname
+from .core.TmsTab import generate_tile_tab_file, tab_filename
+from .core.TmsCatalog import load_catalog, merge_catalogs
+from .core.TmsProbe import is_ok, latency, SLOW_LATENCY
+from .core.TmsSearch import SearchIndex
+from .core.TmsComposite import CompositeSource, resolve_members
+from .core.TmsReproject import ReprojectedSource, source_eccentricity, resampling_available
+from .core.TmsMetrics import metrics
 from axipy.app import mainwindow
 
 import os
 import os.path
-import json
+import time
+from glob import glob
+from urllib.parse import urlsplit
 
 from axipy import provider_manager, Layer, Version
 
@@ -27,16 +38,112 @@ class TmsTreeWidget(QTreeWidget):
         header = self.header()
         header.setSectionResizeMode(QHeaderView.Fixed);
         self.itemDoubleClicked.connect(self.__itemDoubleClicked)
-        self.__load_from_json(self.json_file)
+        self.__icons = IconCache({})
+        self.__probe_report = None
+        self.__index = SearchIndex()
+        self.__filter_text = ''
+        self.__load_catalogs()
         self.__popup_menu = QMenu(self)
+        gateway = plugin.gateway
+        if gateway is not None:
+            # The service list of the gateway is requested before the first service is opened
+            gateway.services()
 
     @property
     def popup_menu(self):
         return self.__popup_menu
 
     def refresh_tree(self):
-        self.clear()
-        self.__load_from_json(self.json_file)
+        self.__load_catalogs()
+
+    def gateway_services(self, services):
+        # (category, data) pairs with the data of the services served by the tile gateway rewritten
+        return [(category, self.__gateway_data(data) or data) for category, data in services]
+
+    def services(self):
+        return [data for _, data in self.category_services()]
+
+    def category_services(self, category=None):
+        # (category name, Service) pairs of one category or of the whole catalog
+        result = []
+        for i in range(self.topLevelItemCount()):
+            cat_item = self.topLevelItem(i)
+            if category is not None and cat_item.key != category:
+                continue
+            for j in range(cat_item.childCount()):
+                result.append((cat_item.key, cat_item.child(j).service))
+        return result
+
+    @property
+    def current_category(self):
+        item = self.currentItem()
+        if item is not None and item.parent() is not None:
+            item = item.parent()
+        return item.key if item is not None else None
+
+    def filter(self, text):
+        # Hides the services not matching the text and makes the best match current
+        self.__filter_text = text
+        ranked = self.__index.search(text)
+        matched = None if ranked is None else set(ranked)
+        items = {}
+        for i in range(self.topLevelItemCount()):
+            cat_item = self.topLevelItem(i)
+            has_visible = False
+            for j in range(cat_item.childCount()):
+                item = cat_item.child(j)
+                items[(cat_item.key, item.key)] = item
+                hidden = matched is not None and (cat_item.key, item.key) not in matched
+                item.setHidden(hidden)
+                has_visible = has_visible or not hidden
+            cat_item.setHidden(not has_visible and matched is not None)
+            if matched is not None and has_visible:
+                cat_item.setExpanded(True)
+        if ranked:
+            best = items[ranked[0]]
+            self.setCurrentItem(best)
+            self.scrollToItem(best)
+
+    @property
+    def probe_report(self):
+        return self.__probe_report
+
+    def set_probe_report(self, report):
+        self.__probe_report = report
+        self.__apply_probe_report()
+
+    def __apply_probe_report(self):
+        services = self.__probe_report['services'] if self.__probe_report is not None else {}
+        for i in range(self.topLevelItemCount()):
+            cat_item = self.topLevelItem(i)
+            for j in range(cat_item.childCount()):
+                item = cat_item.child(j)
+                service = services.get(item.key)
+                if service is None:
+                    item.set_badge(None)
+                    item.setToolTip(0, '')
+                    continue
+                if not service['available']:
+                    item.set_badge('#d32f2f')
+                elif not service['ok'] or service['latency'] > SLOW_LATENCY:
+                    item.set_badge('#f9a825')
+                else:
+                    item.set_badge('#388e3c')
+                item.setToolTip(0, self.__probe_tooltip(service))
+
+    def __probe_tooltip(self, service):
+        lines = []
+        for result in service['mirrors']:
+            host = urlsplit(result['url']).hostname
+            if is_ok(result):
+                lines.append(self.tr('{}: {:.0f} мс (соединение {:.0f}, первый байт {:.0f}, передача {:.0f}), {} байт').format(
+                    host, latency(result) * 1000, result['connect'] * 1000, result['ttfb'] * 1000,
+                    result['transfer'] * 1000, result['size']))
+            elif result['error'] is not None:
+                lines.append('{}: {}'.format(host, result['error']))
+            else:
+                lines.append('{}: HTTP {}'.format(host, result['status']))
+        return '\n'.join(lines)
 
     @property
     def json_file(self):
@@ -53,32 +160,47 @@ class TmsTreeWidget(QTreeWidget):
             return file_name
         return self.__plugin.local_file('ListTileServices_ru.json')
 
+    @property
+    def json_files(self):
+        # The main catalog followed by the additional ones from the 'catalogs' folder of the user data dir
+        from axipy.app import Version
+        files = [self.json_file]
+        if (Version.segments()[0] >= 4):
+            files.extend(sorted(glob(os.path.join(self.__plugin.user_plugin_data_dir(catalogs_dirname()), '*.json'))))
+        return files
+
     def __open_tms(self, data):
+        arguments = data.open_arguments()
         if Version.compare(6,2) == -1:
             web_data = WebOpenData()
-            if 'header' in data:
-                web_data.header = data['header']
-            return provider_manager.tms.open(templateUrl = data['url'],
-                                            type_address = data['typeAddress'],
-                                            minLevel = data['min'] if 'min' in data else 0,
-                                            maxLevel = data['max'] if 'max' in data else 19,
-                                            size = data['tileSize'] if 'tileSize' in data else (256, 256),
-                                            prj = data['prj'] if 'prj' in data else None,
-                                            live_time = data['liveTime'] if 'liveTime' in data else 0,
-                                            alias = data['title'] if 'title' in data else None,
-                                            extra_data = web_data
-                                            )
-        else:
-            return provider_manager.tms.open(templateUrl = data['url'],
-                                            type_address = data['typeAddress'],
-                                            minLevel = data['min'] if 'min' in data else 0,
-                                            maxLevel = data['max'] if 'max' in data else 19,
-                                            size = data['tileSize'] if 'tileSize' in data else (256, 256),
-                                            prj = data['prj'] if 'prj' in data else None,
-                                            live_time = data['liveTime'] if 'liveTime' in data else 0,
-                                            alias = data['title'] if 'title' in data else None
-                                            )
-
+            if data.header is not None:
+                web_data.header = data.header
+            arguments['extra_data'] = web_data
+        return provider_manager.tms.open(**arguments)
+
+    def __serve(self, server, data, source):
+        # Tiles made by the plugin are served by its tile server as an ordinary Web Mercator xyz service
+        server.register(source)
+        return data.replace(url=server.url_template(data.name), type_address='xyz', members=None,
+                            min_level=source.min_level, max_level=source.max_level, prj=None, header=None,
+                            connections=None, rate=None)
+
+    def __source(self, data):
+        # (served data, source) of a service whose tiles are made by the plugin, (data, None) for the
+        # services opened as they are
+        if data.type_service != 'composite' and source_eccentricity(data) is None:
+            return data, None
+        cache = self.__plugin.tile_cache
+        # The tile server registers the image decoder of the host first
+        server = self.__plugin.tile_server
+        if data.type_service == 'composite':
+            members = resolve_members(data, {service.name: service for service in self.services()})
+            source = CompositeSource(data, members, cache)
+            return self.__serve(server, data, source).replace(size=members[0][0].size), source
+        if resampling_available():
+            source = ReprojectedSource(data, cache)
+            return self.__serve(server, data, source), source
+        return data, None
 
     def __open_interactive(self, layer):
         mainwindow.add_layer_interactive(layer)
@@ -89,130 +211,88 @@ class TmsTreeWidget(QTreeWidget):
     def __open_new_map(self, layer):
         mainwindow.add_layer_new_map(layer)
 
+    def __gateway_data(self, data):
+        # Service pointing at the tile gateway, None when the service is opened directly
+        gateway = self.__plugin.gateway
+        return gateway.data(data) if gateway is not None else None
+
     def __open_url(self, data, func_open):
+        start = time.perf_counter()
         raster = None
-        if 'typeService' in data:
-            tp = data['typeService']
-            if tp == 'tms':
-                raster = self.__open_tms(data)
+        source = None
+        gateway_data = self.__gateway_data(data)
+        if gateway_data is not None:
+            raster = self.__open_tms(gateway_data)
         else:
-            print('typeService is not detected')
+            try:
+                data, source = self.__source(data)
+            except Exception as error:
+                QMessageBox.critical(self.__plugin.window(), self.tr('Ошибка'), str(error))
+                return
+            raster = self.__open_tms(data)
         if raster is not None:
-            raster.name = data['name']
+            raster.name = data.name
             layer = Layer.create(raster)
+            metrics().observe('tms_layer_open_seconds', time.perf_counter() - start, service=data.name)
             func_open(layer)
+            # Only the tiles the plugin serves are read from its tile cache; the tiles of the services
+            # opened through the gateway are cached by the gateway
+            if source is not None:
+                self.__plugin.register_service(data, source)
 
     def __itemDoubleClicked(self, item, column):
-        data = item.data(column, Qt.UserRole)
-        if data is not None and 'url' in data:
-            self.__open_url(data, self.__open_interactive)
+        if item.service is not None:
+            self.__open_url(item.service, self.__open_interactive)
     
-    def __add_category(self, cat: dict, imgs):
-        item = QTreeWidgetItem(self)
-        item.setText(0, cat['name'])
-        if 'image' in cat:
-            px  = self.__get_image(cat['image'], imgs)
-            if not px.isNull():
-                item.setIcon(0, px)
-        return item
-
     def open_interactive(self):
         item = self.currentItem()
-        if item is not None:
-            self.__open_url(item.data(0, Qt.UserRole), self.__open_interactive)
+        if item is not None and item.service is not None:
+            self.__open_url(item.service, self.__open_interactive)
 
     def open_current_map(self):
         item = self.currentItem()
-        if item is not None:
-            self.__open_url(item.data(0, Qt.UserRole), self.__open_current_map)
+        if item is not None and item.service is not None:
+            self.__open_url(item.service, self.__open_current_map)
 
     def open_new_map(self):
         item = self.currentItem()
-        if item is not None:
-            self.__open_url(item.data(0, Qt.UserRole), self.__open_new_map)
+        if item is not None and item.service is not None:
+            self.__open_url(item.service, self.__open_new_map)
 
     def save_current(self):
         item = self.currentItem()
-        if item is not None:
-            d = item.data(0, Qt.UserRole)
-            filename = '{}_{}.tab'.format(d['name'], item.parent().text(0)).lower()
+        if item is not None and item.service is not None:
+            d = item.service
+            filename = tab_filename(item.parent().key, d)
             fn , _ =  QFileDialog.getSaveFileName(self.__plugin.window(), self.tr('Сохранение файла'), filename, 'MapInfo (*.tab)')
             if fn:
-                generate_tile_tab_file(fn, item.data(0, Qt.UserRole))
+                generate_tile_tab_file(fn, self.__gateway_data(d) or d)
                 raster = provider_manager.openfile(fn)
                 layer = Layer.create(raster)
                 mainwindow.add_layer_interactive(layer)
 
-    def __get_image(self, name, imgs) -> QPixmap:
-        if name in imgs:
-            im = imgs[name]
-            by = QByteArray.fromBase64(im['data'].encode('ascii'))
-            image = QImage.fromData(by, im['format'])
-            return QPixmap.fromImage(image)
-        return QPixmap()
-
-    def __add_service(self, name: str, base_item, data: dict, imgs):
-        item = QTreeWidgetItem(base_item)
-        item.setText(0, data.get('title', data['name']))
-
-        if 'image' in data:
-            px  = self.__get_image(data['image'], imgs)
-            if not px.isNull():
-                item.setIcon(0, px)
-
-        item.setData(0, Qt.UserRole, data)
-
-    def __load_from_json(self, fn):
-        try:
-            file = open(fn, 'r', encoding="UTF-8") 
-            json_string = file.read()
-            file.close()
-            data = json.loads(json_string)
-            self.__parse_dict_data(data)
-            self.expandAll()
-        except Exception as error:
-            QMessageBox.critical(self.__plugin.window(), self.tr('Ошибка'), str(error))
-
-    def __parse_dict_data_tms(self, tms):
-        data = {
-            'name': tms['name'],
-            'url': tms['url']
-        }
-        data['typeAddress'] = tms['type'] if 'type' in tms else 'xyz'
-        if 'title' in tms:
-            data['title'] = tms['title']
-        if 'description' in tms:
-            data['description'] = tms['description']
-        if 'image' in tms:
-            data['image'] = tms['image']
-        if 'size' in tms:
-            s = tms['size']
-            data['size'] = (s['width'], s['height'])
-        if 'level' in tms:
-            l = tms['level']
-            data['min'] = l['min']
-            data['max'] = l['max']
-        if 'cs' in tms:
-            data['prj'] = tms['cs']
-        if 'liveTime' in tms:
-            data['liveTime'] = tms['liveTime']
-        if 'header' in tms:
-            data['header'] = tms['header']
-        return data
-
-    def __parse_dict_data(self, data):
-        if 'services' in data and 'category' in data['services']:
-            cats = data['services']['category']
-            imgs = {}
-            if 'images' in data:
-                imgs = data['images']
-            for cat in cats:
-                cat_item = self.__add_category(cat, imgs)
-                for tms in cat['tms']:
-                    data = self.__parse_dict_data_tms(tms)
-                    data['typeService'] = 'tms'
-                    self.__add_service(tms['name'], cat_item, data, imgs)
-    
+    def __load_catalogs(self):
+        catalogs = []
+        errors = []
+        with metrics().timer('tms_catalog_load_seconds'):
+            for fn in self.json_files:
+                try:
+                    catalog = load_catalog(fn, self.__plugin.data_file(snapshot_filename(fn)))
+                    # Invalid services are left out of the catalog
+                    errors.extend('{}: {}'.format(fn, error) for error in catalog['errors'])
+                    catalogs.append(catalog)
+                except Exception as error:
+                    errors.append('{}: {}'.format(fn, error))
+            catalog = merge_catalogs(catalogs)
+        with metrics().timer('tms_tree_build_seconds'):
+            update_tree(self, catalog, self.__icons)
+            self.__index.build(catalog)
+        if self.__filter_text:
+            self.filter(self.__filter_text)
+        self.__apply_probe_report()
+        if errors:
+            QMessageBox.critical(self.__plugin.window(), self.tr('Ошибка'), '\n'.join(errors))
+
     def __show_popup(self):
         self.popup_menu.exec_(QCursor.pos())
 
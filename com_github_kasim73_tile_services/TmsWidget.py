@@ -1,13 +1,82 @@
 import os
-from PySide2.QtWidgets import QWidget, QVBoxLayout, QTextBrowser, QSplitter, QToolBar, QAction, QMessageBox, QSizePolicy
-from PySide2.QtCore import Qt, QSize, QUrl
+import threading
+from PySide2.QtWidgets import QWidget, QVBoxLayout, QTextBrowser, QSplitter, QToolBar, QAction, QMessageBox, QSizePolicy, \
+    QProgressDialog, QFileDialog, QLineEdit
+from PySide2.QtCore import Qt, QSize, QUrl, QThread, Signal
 from PySide2.QtGui import QIcon, QDesktopServices
 
 from .TmsTreeWidget import TmsTreeWidget
 from axipy.app import Notifications
 from axipy import view_manager
 
-from .TmsUtils import doc_index_filename, json_filename
+from .core.TmsUtils import doc_index_filename, json_filename, download_catalog, replace_file, \
+    load_validators, save_validators, DownloadCancelled, probe_filename
+from .core.TmsProbe import ServiceProbe, load_report, save_report, export_report
+from .core.TmsExport import CatalogExporter
+from .core.TmsMetrics import metrics
+
+
+class CatalogDownloader(QThread):
+
+    progress = Signal(int, int)
+    downloaded = Signal(object, object)
+    failed = Signal(str)
+
+    def __init__(self, url, validators) -> None:
+        super().__init__()
+        self.__url = url
+        self.__validators = validators
+        self.__cancelled = threading.Event()
+
+    def cancel(self):
+        self.__cancelled.set()
+
+    def run(self):
+        try:
+            with metrics().timer('tms_catalog_download_seconds'):
+                # Not retried: the user waits for it and can refresh again
+                data, validators = download_catalog(self.__url, self.__validators,
+                                                    progress=self.progress.emit,
+                                                    cancelled=self.__cancelled, retries=0)
+            if data is not None:
+                metrics().inc('tms_catalog_download_bytes_total', len(data))
+            self.downloaded.emit(data, validators)
+        except DownloadCancelled:
+            pass
+        except Exception as error:
+            self.failed.emit(str(error))
+
+
+class ProbeRunner(QThread):
+
+    reported = Signal(object)
+
+    def __init__(self, services) -> None:
+        super().__init__()
+        self.__probe = ServiceProbe(services)
+        self.__cancelled = False
+
+    def cancel(self):
+        self.__cancelled = True
+        self.__probe.cancel()
+
+    def run(self):
+        report = self.__probe.run()
+        if not self.__cancelled:
+            self.reported.emit(report)
+
+
+class ExportRunner(QThread):
+
+    progress = Signal(int, int)
+
+    def __init__(self, services, directory) -> None:
+        super().__init__()
+        self.exporter = CatalogExporter(services, directory)
+        self.files = []
+
+    def run(self):
+        self.files = self.exporter.run(self.progress.emit)
 
 
 class ToolBar(QToolBar):
@@ -53,6 +122,17 @@ class TmsWidget(QWidget):
         spacer.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         tb_main.addWidget(spacer)
 
+        self.action_probe = QAction(QIcon(plugin.local_file('probe.svg')), self.tr('Проверить сервисы'))
+        self.action_probe.triggered.connect(self.__probe_triggered)
+        self.action_probe.setToolTip(self.tr('Проверить доступность и скорость ответа сервисов'))
+        tb_main.addAction(self.action_probe)
+
+        self.action_diagnostics = QAction(QIcon(plugin.local_file('metrics.svg')), self.tr('Диагностика'))
+        self.action_diagnostics.triggered.connect(self.__diagnostics_triggered)
+        self.action_diagnostics.setToolTip(self.tr('Время операций и статистика запросов к сервисам'))
+        tb_main.addAction(self.action_diagnostics)
+        self.__diagnostics = None
+
         self.action_refresh = QAction(QIcon(plugin.local_file('refresh.png')), self.tr('Обновить'))
         self.action_refresh.triggered.connect(self.__refresh_triggered)
         self.action_refresh.setToolTip(self.tr('Обновить список с сервера'))
@@ -65,8 +145,14 @@ class TmsWidget(QWidget):
 
         layout.addWidget(tb_main)
 
+        self.__search = QLineEdit()
+        self.__search.setPlaceholderText(self.tr('Поиск'))
+        self.__search.setClearButtonEnabled(True)
+        layout.addWidget(self.__search)
+
         self.__tree = TmsTreeWidget(plugin)
         self.__tree.currentItemChanged.connect(self.__item_changed)
+        self.__search.textChanged.connect(self.__tree.filter)
         splitter.addWidget(self.__tree)
 
         self.action_expand.toggled.connect(self.__expand_toogled)
@@ -95,6 +181,20 @@ class TmsWidget(QWidget):
         self.__tree.popup_menu.addAction(self.action_open_new_map)
         self.__tree.popup_menu.addAction(self.action_save)
 
+        self.action_export_category = QAction(self.tr('Сохранить категорию в папку...'))
+        self.action_export_category.triggered.connect(self.__export_category_triggered)
+        self.action_export_category.setEnabled(False)
+        self.action_export_all = QAction(self.tr('Сохранить весь каталог в папку...'))
+        self.action_export_all.triggered.connect(self.__export_all_triggered)
+        self.__tree.popup_menu.addAction(self.action_export_category)
+        self.__tree.popup_menu.addAction(self.action_export_all)
+
+        self.action_export_probe = QAction(self.tr('Сохранить отчет о проверке...'))
+        self.action_export_probe.triggered.connect(self.__export_probe_triggered)
+        self.__tree.popup_menu.addSeparator()
+        self.__tree.popup_menu.addAction(self.action_probe)
+        self.__tree.popup_menu.addAction(self.action_export_probe)
+
         self.__tree.itemCollapsed.connect(self.__treeItemCollapsed)
 
         self.__has_mapview = len(view_manager.mapviews)
@@ -102,13 +202,23 @@ class TmsWidget(QWidget):
         view_manager.count_changed.connect(self.__mapview_changed)
 
         self.__enable_actions(False)
+        self.__downloader = None
+        self.__progress = None
+
+        self.__exporter = None
+        self.__prober = None
+        # Services are probed only on request, the last report is shown until then
+        report = load_report(self.__probe_file)
+        if report is not None:
+            self.__tree.set_probe_report(report)
+        self.action_export_probe.setEnabled(self.__tree.probe_report is not None)
 
     def __mapview_changed(self):
         self.__has_mapview = len(view_manager.mapviews)
         current_item = self.__tree.currentItem()
         enable = False
         if current_item is not None:
-            enable = current_item.data(0, Qt.UserRole) is not None and self.__has_mapview
+            enable = current_item.service is not None and self.__has_mapview
         self.action_open_current_map.setEnabled(enable)
 
     @property
@@ -125,11 +235,13 @@ class TmsWidget(QWidget):
         self.action_open_new_map.setEnabled(enable)
 
     def __item_changed(self, current, previons):
-        data = current.data(0, Qt.UserRole)
+        self.action_export_category.setEnabled(current is not None)
+        data = current.service if current is not None else None
         has_data = data is not None
         self.__enable_actions(has_data)
-        if has_data and 'description' in data:
-            self.__textBrowser.setHtml(data['description'])
+        self.action_save.setEnabled(has_data and data.type_service == 'tms')
+        if has_data and data.description is not None:
+            self.__textBrowser.setHtml(data.description)
         else:
             self.__textBrowser.clear()
 
@@ -145,42 +257,173 @@ class TmsWidget(QWidget):
         else:
             self.__tree.collapseAll()
 
-    def __update_file(self, file_name, data):
-        if os.path.isfile(file_name) and data is not None:
-            bak_file_name = file_name + '.BAK'
-            if os.path.exists(bak_file_name):
-                os.remove(bak_file_name)
-            os.rename(file_name, bak_file_name)
-        f = open(file_name, "wb")
-        f.write(data)
-        f.close()
-
     def __refresh_triggered(self):
-        from urllib.request import Request, urlopen
-        from pathlib import Path
-        from axipy.app import Version
+        if self.__downloader is not None:
+            return
         if QMessageBox.question(self.__plugin.window(), self.windowTitle(),
                 self.tr('Обновить данные?')) != QMessageBox.Yes:
             return
-        file_name  = self.__tree.json_file
+        print('Url:', self.__update_url)
+        self.__downloader = CatalogDownloader(self.__update_url, load_validators(self.__tree.json_file))
+        self.__progress = QProgressDialog(self.tr('Загрузка списка сервисов...'), self.tr('Отмена'), 0, 0, self)
+        self.__progress.setWindowTitle(self.windowTitle())
+        self.__progress.setMinimumDuration(500)
+        self.__progress.canceled.connect(self.__downloader.cancel)
+        self.__downloader.progress.connect(self.__download_progress)
+        self.__downloader.downloaded.connect(self.__download_finished)
+        self.__downloader.failed.connect(self.__download_failed)
+        self.__downloader.finished.connect(self.__downloader_finished)
+        self.action_refresh.setEnabled(False)
+        self.__downloader.start()
+
+    def stop(self):
+        if self.__downloader is not None:
+            self.__downloader.cancel()
+            self.__downloader.wait()
+        if self.__prober is not None:
+            self.__prober.cancel()
+            self.__prober.wait()
+        if self.__exporter is not None:
+            self.__exporter.exporter.cancel()
+            self.__exporter.wait()
+        if self.__diagnostics is not None:
+            self.__diagnostics.close()
+
+    def __export_category_triggered(self):
+        category = self.__tree.current_category
+        if category is not None:
+            self.__start_export(self.__tree.category_services(category))
+
+    def __export_all_triggered(self):
+        self.__start_export(self.__tree.category_services())
+
+    def __start_export(self, services):
+        # Composite services have no url of their own to write into a TAB file unless the tile gateway serves them
+        services = [(category, data) for category, data in self.__tree.gateway_services(services)
+                    if data.type_service == 'tms']
+        if self.__exporter is not None or not services:
+            return
+        directory = QFileDialog.getExistingDirectory(self.__plugin.window(), self.tr('Выбор папки'))
+        if not directory:
+            return
+        self.__exporter = ExportRunner(services, directory)
+        progress = QProgressDialog(self.tr('Сохранение TAB-файлов...'), self.tr('Отмена'), 0, len(services), self)
+        progress.setWindowTitle(self.windowTitle())
+        progress.setMinimumDuration(500)
+        progress.canceled.connect(self.__exporter.exporter.cancel)
+        self.__exporter.progress.connect(lambda done, total: progress.setValue(done))
+        self.__exporter.finished.connect(progress.deleteLater)
+        self.__exporter.finished.connect(self.__export_finished)
+        self.__exporter.start()
+
+    def __export_finished(self):
+        runner = self.__exporter
+        self.__exporter = None
+        runner.deleteLater()
+        if runner.exporter.errors:
+            QMessageBox.critical(self.__plugin.window(), self.tr('Ошибка'), '\n'.join(runner.exporter.errors))
+        else:
+            self.__plugin.notifications.push('', self.tr('Сохранено файлов: {}').format(len(runner.files)), Notifications.Information)
+
+    @property
+    def __probe_file(self):
+        return self.__plugin.data_file(probe_filename())
+
+    def __start_probe(self):
+        if self.__prober is not None:
+            return
+        self.__prober = ProbeRunner([data for data in self.__tree.services() if data.type_service == 'tms'])
+        self.__prober.reported.connect(self.__probe_reported)
+        self.__prober.finished.connect(self.__prober_finished)
+        self.action_probe.setEnabled(False)
+        self.__prober.start()
+
+    def __probe_triggered(self):
+        self.__start_probe()
+
+    def __probe_reported(self, report):
+        self.__tree.set_probe_report(report)
+        self.action_export_probe.setEnabled(True)
         try:
-            print('Url:', self.__update_url)
-            req = Request(self.__update_url, headers={'User-Agent': 'Mozilla/5.0'})
-            data = urlopen(req).read()
+            save_report(self.__probe_file, report)
+        except OSError as error:
+            print('Probe report is not saved:', error)
+
+    def __prober_finished(self):
+        self.__prober.deleteLater()
+        self.__prober = None
+        self.action_probe.setEnabled(True)
+
+    def __export_probe_triggered(self):
+        report = self.__tree.probe_report
+        if report is None:
+            return
+        fn, _ = QFileDialog.getSaveFileName(self.__plugin.window(), self.tr('Сохранение файла'), 'probe_report.csv',
+                                            'CSV (*.csv);;JSON (*.json)')
+        if fn:
             try:
-                self.__update_file(file_name, data)
-            except PermissionError:
-                if (Version.segments()[0] >= 4):
-                    Path(self.__plugin.user_plugin_data_dir()).mkdir(parents=True, exist_ok=True)
-                    file_name = self.__plugin.user_plugin_data_dir(json_filename(self.__plugin.language))
-                    self.__update_file(file_name, data)
-                else:
-                    raise
+                export_report(fn, report)
+            except Exception as error:
+                QMessageBox.critical(self.__plugin.window(), self.tr('Ошибка'), str(error))
+
+    def __download_progress(self, received, total):
+        if total > 0:
+            self.__progress.setMaximum(total)
+            self.__progress.setValue(min(received, total))
+
+    def __save_catalog(self, data, validators):
+        from pathlib import Path
+        from axipy.app import Version
+        file_name = self.__tree.json_file
+        try:
+            replace_file(file_name, data)
+        except PermissionError:
+            if (Version.segments()[0] >= 4):
+                Path(self.__plugin.user_plugin_data_dir()).mkdir(parents=True, exist_ok=True)
+                file_name = self.__plugin.user_plugin_data_dir(json_filename(self.__plugin.language))
+                replace_file(file_name, data)
+            else:
+                raise
+        if validators:
+            save_validators(file_name, validators)
+        return file_name
+
+    def __download_finished(self, data, validators):
+        self.__progress.reset()
+        if data is None:
+            self.__plugin.notifications.push('', self.tr('Список сервисов не изменился'), Notifications.Information)
+            return
+        try:
+            file_name = self.__save_catalog(data, validators)
             self.__tree.refresh_tree()
             self.__plugin.notifications.push('', self.tr(f"Список '{file_name}' обновлен"), Notifications.Information)
         except Exception as error:
             QMessageBox.critical(self.__plugin.window(), self.tr('Ошибка'), str(error))
 
+    def __download_failed(self, message):
+        self.__progress.reset()
+        QMessageBox.critical(self.__plugin.window(), self.tr('Ошибка'), message)
+
+    def __downloader_finished(self):
+        self.__progress.reset()
+        self.__progress.deleteLater()
+        self.__progress = None
+        self.__downloader.deleteLater()
+        self.__downloader = None
+        self.action_refresh.setEnabled(True)
+
+    def __diagnostics_triggered(self):
+        if self.__diagnostics is None:
+            from .TmsDiagnostics import DiagnosticsDialog
+            self.__diagnostics = DiagnosticsDialog(self.__plugin, self.__plugin.window())
+            self.__diagnostics.setAttribute(Qt.WA_DeleteOnClose)
+            self.__diagnostics.destroyed.connect(self.__diagnostics_closed)
+        self.__diagnostics.show()
+        self.__diagnostics.raise_()
+
+    def __diagnostics_closed(self):
+        self.__diagnostics = None
+
     def __help_triggered(self):
         from axipy.app import Version, mainwindow
         file_name = self.__plugin.local_file(os.path.join('documentation', doc_index_filename(self.__plugin.language)))
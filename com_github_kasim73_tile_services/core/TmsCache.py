@@ -0,0 +1,293 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+from .TmsMetrics import metrics
+
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+SCHEMA_VERSION = '2'
+ACCESS_FLUSH_COUNT = 256
+ACCESS_FLUSH_INTERVAL = 5.0
+
+
+def tile_hash(data):
+    return hashlib.sha1(data).digest()
+
+
+class TileCache:
+    """Persistent tile store keyed by (service, level, row, col) with LRU eviction.
+
+    Payloads are content addressed: the `tiles` index maps a tile to the
+    hash of its data and identical tiles (sea, empty land, "no data"
+    placeholders) share one reference counted row of `blobs`. The size
+    budget applies to the stored blobs. Access times of the hits are kept
+    in memory and written in batches, before any eviction.
+    """
+
+    def __init__(self, file_name, max_bytes=DEFAULT_MAX_BYTES) -> None:
+        self.__lock = threading.RLock()
+        self.__file_name = file_name
+        self.__db = sqlite3.connect(file_name, check_same_thread=False)
+        self.__db.execute('PRAGMA journal_mode=WAL')
+        self.__db.execute('PRAGMA synchronous=NORMAL')
+        old_columns = [r[1] for r in self.__db.execute('PRAGMA table_info(tiles)')]
+        if 'data' in old_columns:
+            self.__db.execute('ALTER TABLE tiles RENAME TO tiles_v1')
+        self.__db.execute('''CREATE TABLE IF NOT EXISTS blobs (
+                hash BLOB PRIMARY KEY,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                refs INTEGER NOT NULL) WITHOUT ROWID''')
+        self.__db.execute('''CREATE TABLE IF NOT EXISTS tiles (
+                service TEXT NOT NULL,
+                level INTEGER NOT NULL,
+                row INTEGER NOT NULL,
+                col INTEGER NOT NULL,
+                hash BLOB NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (service, level, row, col))''')
+        if 'data' in old_columns:
+            self.__migrate()
+        # Original sizes of the re-encoded blobs, see TmsTranscode
+        self.__db.execute('''CREATE TABLE IF NOT EXISTS transcoded (
+                hash BLOB PRIMARY KEY,
+                original_size INTEGER NOT NULL) WITHOUT ROWID''')
+        self.__db.execute('CREATE INDEX IF NOT EXISTS tiles_accessed ON tiles (accessed)')
+        self.__db.execute('CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)')
+        self.__db.execute("INSERT OR IGNORE INTO metadata VALUES ('format', 'mixed')")
+        self.__db.execute("INSERT OR REPLACE INTO metadata VALUES ('schema', ?)", (SCHEMA_VERSION,))
+        self.__db.commit()
+        self.__max_bytes = max_bytes
+        self.__total_bytes = self.__db.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+        self.__live_times = {}
+        self.__accessed = {}
+        self.__flushed = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __migrate(self):
+        # Caches of the first version stored the data in the tiles table
+        self.__db.create_function('tile_hash', 1, tile_hash, deterministic=True)
+        self.__db.execute('''INSERT INTO blobs SELECT tile_hash(data), data, size, COUNT(*)
+                FROM tiles_v1 GROUP BY tile_hash(data)''')
+        self.__db.execute('''INSERT INTO tiles SELECT service, level, row, col, tile_hash(data), created, accessed
+                FROM tiles_v1''')
+        self.__db.execute('DROP TABLE tiles_v1')
+
+    @property
+    def max_bytes(self):
+        return self.__max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, value):
+        with self.__lock:
+            self.__max_bytes = value
+            self.__evict()
+            self.__db.commit()
+
+    @property
+    def total_bytes(self):
+        return self.__total_bytes
+
+    def set_live_time(self, service, live_time):
+        # live_time has the same meaning as the catalog 'liveTime' key (seconds, 0 - unlimited)
+        if live_time:
+            self.__live_times[service] = live_time
+        else:
+            self.__live_times.pop(service, None)
+
+    def get(self, service, level, row, col):
+        with self.__lock:
+            rec = self.__db.execute('''SELECT b.data, t.created FROM tiles t JOIN blobs b ON b.hash = t.hash
+                    WHERE t.service=? AND t.level=? AND t.row=? AND t.col=?''', (service, level, row, col)).fetchone()
+            now = time.time()
+            if rec is not None:
+                live_time = self.__live_times.get(service, 0)
+                if live_time and now - rec[1] > live_time:
+                    self.__delete(service, level, row, col)
+                    self.__accessed.pop((service, level, row, col), None)
+                    self.__db.commit()
+                    rec = None
+            if rec is None:
+                self.misses += 1
+                metrics().inc('tms_cache_misses_total', service=service)
+                return None
+            self.__accessed[(service, level, row, col)] = now
+            if len(self.__accessed) >= ACCESS_FLUSH_COUNT or \
+                    time.monotonic() - self.__flushed >= ACCESS_FLUSH_INTERVAL:
+                self.__flush_access()
+                self.__db.commit()
+            self.hits += 1
+            metrics().inc('tms_cache_hits_total', service=service)
+            return rec[0]
+
+    def contains(self, service, level, row, col):
+        with self.__lock:
+            rec = self.__db.execute('SELECT created FROM tiles WHERE service=? AND level=? AND row=? AND col=?',
+                                    (service, level, row, col)).fetchone()
+        if rec is None:
+            return False
+        live_time = self.__live_times.get(service, 0)
+        return not live_time or time.time() - rec[0] <= live_time
+
+    def put(self, service, level, row, col, data):
+        size = len(data)
+        if size > self.__max_bytes:
+            return
+        digest = tile_hash(data)
+        with self.__lock:
+            old = self.__db.execute('SELECT hash FROM tiles WHERE service=? AND level=? AND row=? AND col=?',
+                                    (service, level, row, col)).fetchone()
+            if old is None or old[0] != digest:
+                self.__acquire(digest, data)
+                if old is not None:
+                    self.__release(old[0])
+            now = time.time()
+            self.__accessed.pop((service, level, row, col), None)
+            self.__db.execute('INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (service, level, row, col, digest, now, now))
+            self.__evict()
+            self.__db.commit()
+
+    def remove_service(self, service):
+        with self.__lock:
+            released = self.__db.execute('SELECT hash, COUNT(*) FROM tiles WHERE service=? GROUP BY hash',
+                                         (service,)).fetchall()
+            self.__db.execute('DELETE FROM tiles WHERE service=?', (service,))
+            for digest, count in released:
+                self.__release(digest, count)
+            self.__db.commit()
+
+    def clear(self):
+        with self.__lock:
+            self.__accessed.clear()
+            self.__db.execute('DELETE FROM tiles')
+            self.__db.execute('DELETE FROM blobs')
+            self.__db.execute('DELETE FROM transcoded')
+            self.__db.commit()
+            self.__total_bytes = 0
+
+    def stats(self):
+        with self.__lock:
+            count, logical = self.__db.execute('''SELECT COUNT(*), COALESCE(SUM(b.size), 0)
+                    FROM tiles t JOIN blobs b ON b.hash = t.hash''').fetchone()
+            blobs = self.__db.execute('SELECT COUNT(*) FROM blobs').fetchone()[0]
+        requests = self.hits + self.misses
+        return {
+            'tiles': count,
+            'blobs': blobs,
+            'bytes': self.__total_bytes,
+            'logical_bytes': logical,
+            'dedup_ratio': logical / self.__total_bytes if self.__total_bytes else 1.0,
+            'max_bytes': self.__max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / requests if requests else 0.0
+        }
+
+    def untranscoded(self, service):
+        # (hash, data) of the blobs of a service that were not re-encoded yet
+        with self.__lock:
+            hashes = [r[0] for r in self.__db.execute('''SELECT DISTINCT t.hash FROM tiles t
+                    LEFT JOIN transcoded x ON x.hash = t.hash WHERE t.service=? AND x.hash IS NULL''', (service,))]
+        for digest in hashes:
+            with self.__lock:
+                rec = self.__db.execute('SELECT data FROM blobs WHERE hash=?', (digest,)).fetchone()
+            if rec is not None:
+                yield digest, rec[0]
+
+    def replace_blobs(self, blobs):
+        # (hash, new data, original size) of re-encoded blobs; the hash of the original data is kept,
+        # so that a tile downloaded again shares the re-encoded blob
+        with self.__lock:
+            for digest, data, original_size in blobs:
+                rec = self.__db.execute('SELECT size FROM blobs WHERE hash=?', (digest,)).fetchone()
+                if rec is None:
+                    continue
+                self.__db.execute('UPDATE blobs SET data=?, size=? WHERE hash=?', (sqlite3.Binary(data), len(data), digest))
+                self.__db.execute('INSERT OR REPLACE INTO transcoded VALUES (?, ?)', (digest, original_size))
+                self.__total_bytes += len(data) - rec[0]
+            self.__db.commit()
+
+    def transcode_stats(self):
+        # Original and stored bytes of the re-encoded blobs
+        with self.__lock:
+            return self.__db.execute('''SELECT COALESCE(SUM(x.original_size), 0), COALESCE(SUM(b.size), 0)
+                    FROM transcoded x JOIN blobs b ON b.hash = x.hash''').fetchone()
+
+    def dedup_stats(self):
+        # Per service: tiles, distinct payloads, their logical and stored size and the ratio of both.
+        # The query reads the whole index, so it runs on its own connection without blocking the cache.
+        db = sqlite3.connect(self.__file_name)
+        try:
+            rows = db.execute('''SELECT service, SUM(refs), COUNT(*), SUM(refs * size), SUM(size) FROM (
+                    SELECT t.service, COUNT(*) AS refs, b.size FROM tiles t JOIN blobs b ON b.hash = t.hash
+                    GROUP BY t.service, t.hash) GROUP BY service''').fetchall()
+        finally:
+            db.close()
+        return {service: {
+            'tiles': tiles,
+            'unique': unique,
+            'bytes': logical,
+            'unique_bytes': stored,
+            'dedup_ratio': logical / stored if stored else 1.0
+        } for service, tiles, unique, logical, stored in rows}
+
+    def close(self):
+        with self.__lock:
+            self.__flush_access()
+            self.__db.commit()
+            self.__db.close()
+
+    def __acquire(self, digest, data):
+        if self.__db.execute('UPDATE blobs SET refs=refs+1 WHERE hash=?', (digest,)).rowcount == 0:
+            self.__db.execute('INSERT INTO blobs VALUES (?, ?, ?, 1)', (digest, sqlite3.Binary(data), len(data)))
+            self.__total_bytes += len(data)
+
+    def __release(self, digest, count=1):
+        # Blobs without references are removed at once
+        self.__db.execute('UPDATE blobs SET refs=refs-? WHERE hash=?', (count, digest))
+        rec = self.__db.execute('SELECT size FROM blobs WHERE hash=? AND refs<=0', (digest,)).fetchone()
+        if rec is not None:
+            self.__db.execute('DELETE FROM blobs WHERE hash=?', (digest,))
+            self.__db.execute('DELETE FROM transcoded WHERE hash=?', (digest,))
+            self.__total_bytes -= rec[0]
+
+    def __delete(self, service, level, row, col):
+        rec = self.__db.execute('SELECT hash FROM tiles WHERE service=? AND level=? AND row=? AND col=?',
+                                (service, level, row, col)).fetchone()
+        if rec is not None:
+            self.__db.execute('DELETE FROM tiles WHERE service=? AND level=? AND row=? AND col=?',
+                              (service, level, row, col))
+            self.__release(rec[0])
+
+    def __flush_access(self):
+        # Writes the access times of the hits since the last flush
+        if self.__accessed:
+            self.__db.executemany('UPDATE tiles SET accessed=? WHERE service=? AND level=? AND row=? AND col=?',
+                                  [(now,) + key for key, now in self.__accessed.items()])
+            self.__accessed.clear()
+        self.__flushed = time.monotonic()
+
+    def __evict(self):
+        # Drop the least recently used tiles in batches until the budget is met; a shared payload
+        # is freed with its last tile
+        if self.__total_bytes > self.__max_bytes:
+            self.__flush_access()
+        while self.__total_bytes > self.__max_bytes:
+            recs = self.__db.execute('SELECT rowid, hash FROM tiles ORDER BY accessed LIMIT 256').fetchall()
+            if not recs:
+                self.__db.execute('DELETE FROM blobs')
+                self.__total_bytes = 0
+                break
+            for rowid, digest in recs:
+                self.__db.execute('DELETE FROM tiles WHERE rowid=?', (rowid,))
+                self.__release(digest)
+                self.evictions += 1
+                if self.__total_bytes <= self.__max_bytes:
+                    break
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import marshal
+import sys
+
+from .TmsUtils import replace_file
+from .TmsService import Service, CatalogError
+
+
+SNAPSHOT_VERSION = 6
+
+
+def parse_services(cat, errors):
+    # Services of a catalog json category; invalid ones are left out and reported to errors
+    services = []
+    for tms in cat.get('tms', []):
+        try:
+            services.append(Service.from_json(tms))
+        except CatalogError as error:
+            errors.append('{}: {}'.format(cat.get('name'), error))
+    return services
+
+
+def iter_services(catalog):
+    # yields (category name, Service) pairs of the catalog json data; invalid services are reported to stderr
+    if 'services' in catalog and 'category' in catalog['services']:
+        for cat in catalog['services']['category']:
+            errors = []
+            for data in parse_services(cat, errors):
+                yield cat['name'], data
+            for error in errors:
+                print(error, file=sys.stderr)
+
+
+def normalize_catalog(data):
+    categories = []
+    errors = []
+    if 'services' in data and 'category' in data['services']:
+        for cat in data['services']['category']:
+            categories.append({
+                'name': cat['name'],
+                'image': cat.get('image'),
+                'services': parse_services(cat, errors)
+            })
+    return {'categories': categories, 'images': data.get('images', {}), 'errors': errors}
+
+
+def merge_catalogs(catalogs):
+    # Later catalogs add categories and services. A service with an already known name replaces
+    # the earlier one: in place within the same category, otherwise it moves to the new category.
+    # Service names stay unique, composite services find their members by name.
+    categories = {}
+    owners = {}
+    images = {}
+    for catalog in catalogs:
+        images.update(catalog['images'])
+        for cat in catalog['categories']:
+            merged = categories.get(cat['name'])
+            if merged is None:
+                merged = categories[cat['name']] = {'name': cat['name'], 'image': cat['image'], 'services': {}}
+            elif cat['image'] is not None:
+                merged['image'] = cat['image']
+            for data in cat['services']:
+                owner = owners.get(data.name)
+                if owner is not None and owner is not merged:
+                    del owner['services'][data.name]
+                    owner['moved'] = True
+                merged['services'][data.name] = data
+                owners[data.name] = merged
+    # Categories whose services all moved away are dropped
+    return {
+        'categories': [{'name': cat['name'], 'image': cat['image'], 'services': list(cat['services'].values())}
+                       for cat in categories.values() if cat['services'] or not cat.get('moved')],
+        'images': images
+    }
+
+
+def _read_snapshot(snapshot_name):
+    try:
+        with open(snapshot_name, 'rb') as f:
+            header, catalog = marshal.loads(f.read())
+        if header[0] == SNAPSHOT_VERSION and header[1] == tuple(sys.version_info[:2]):
+            for cat in catalog['categories']:
+                cat['services'] = [Service.from_tuple(values) for values in cat['services']]
+            return header, catalog
+    except (OSError, EOFError, ValueError, TypeError, IndexError):
+        pass
+    return None, None
+
+
+def _write_snapshot(snapshot_name, header, catalog):
+    try:
+        # Services are stored as plain tuples, marshal knows no classes
+        plain = dict(catalog, categories=[dict(cat, services=[data.to_tuple() for data in cat['services']])
+                                          for cat in catalog['categories']])
+        replace_file(snapshot_name, marshal.dumps((header, plain)))
+    except OSError:
+        pass
+
+
+def load_catalog(file_name, snapshot_name=None):
+    """Loads the normalized catalog, using the precompiled snapshot when the json file is unchanged.
+
+    The snapshot is valid for the same content hash of the source file, so
+    an edit that keeps the size and the modification time is not missed and
+    touching or copying the file does not force a reparse.
+    """
+    header, catalog = (None, None) if snapshot_name is None else _read_snapshot(snapshot_name)
+    with open(file_name, 'rb') as f:
+        content = f.read()
+    digest = hashlib.sha1(content).hexdigest()
+    if header is not None and header[2] == digest:
+        return catalog
+    catalog = normalize_catalog(json.loads(content.decode('utf-8')))
+    if snapshot_name is not None:
+        _write_snapshot(snapshot_name, (SNAPSHOT_VERSION, tuple(sys.version_info[:2]), digest), catalog)
+    return catalog
@@ -0,0 +1,106 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from .TmsUrl import UrlTemplate
+from .TmsHttp import scheduler, service_headers
+from .TmsImage import decode_image, encode_png, blend
+from .TmsReproject import ReprojectedSource, source_eccentricity
+
+
+DEFAULT_WORKERS = 8
+
+
+def resolve_members(data, services):
+    # (member service, opacity) pairs of a composite service; services maps names to parsed services
+    members = []
+    for name, opacity in data.members:
+        member = services.get(name)
+        if member is None:
+            raise ValueError("Service '{}' is not found".format(name))
+        if member.type_service != 'tms':
+            raise ValueError("Service '{}' can not be a part of a composite service".format(name))
+        if member.prj is not None and source_eccentricity(member) is None:
+            raise ValueError("Coordinate system of service '{}' is not supported".format(name))
+        members.append((member, opacity))
+    return members
+
+
+def composite_levels(data, members):
+    # Levels available in every member, narrowed by the own `level` of the composite
+    low = max([data.min_level] + [m.min_level for m, _ in members])
+    high = min([data.max_level] + [m.max_level for m, _ in members])
+    return low, high
+
+
+def composite_live_time(members):
+    # The shortest limited live time of the members, 0 (unlimited) when no member expires
+    return min((m.live_time for m, _ in members if m.live_time), default=0)
+
+
+class CompositeSource:
+    """Tiles of a composite service: member tiles fetched concurrently and alpha-blended into one PNG.
+
+    A member tile that can not be fetched is left out of the blend; a tile
+    with no member available at all raises the last error.
+    """
+
+    def __init__(self, data, members, cache=None, workers=DEFAULT_WORKERS) -> None:
+        self.__name = data.name
+        # Member images are taken from the url or resampled from an elliptical Mercator service
+        self.__members = []
+        self.__reprojected = []
+        for member, opacity in members:
+            if member.prj is not None:
+                source = ReprojectedSource(member)
+                self.__reprojected.append(source)
+                self.__members.append((source.image, opacity))
+            else:
+                self.__members.append((self.__fetcher(member), opacity))
+        self.__cache = cache
+        self.__pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='TmsComposite')
+        self.min_level, self.max_level = composite_levels(data, members)
+        if cache is not None:
+            cache.set_live_time(self.__name, data.live_time or composite_live_time(members))
+
+    @property
+    def name(self):
+        return self.__name
+
+    @staticmethod
+    def __fetcher(data):
+        template = UrlTemplate(data)
+        headers = service_headers(data)
+        scheduler().configure_service(data)
+
+        def fetch(level, x, y, background=False):
+            return decode_image(scheduler().get(template.url(level, x, y), headers, service=data.name,
+                                                background=background))
+        return fetch
+
+    def tile(self, level, x, y, background=False):
+        # `background` downloads give way to the other downloads (see HttpScheduler.request)
+        if self.__cache is not None:
+            tile = self.__cache.get(self.__name, level, x, y)
+            if tile is not None:
+                return tile
+        futures = [(self.__pool.submit(fetch, level, x, y, background), opacity) for fetch, opacity in self.__members]
+        layers = []
+        error = None
+        for future, opacity in futures:
+            try:
+                layers.append((future.result(), opacity))
+            except Exception as e:
+                error = e
+                print('Composite {} {}/{}/{}: {}'.format(self.__name, level, x, y, e), file=sys.stderr)
+        if not layers:
+            raise error
+        shape = layers[0][0].shape
+        tile = encode_png(blend([layer for layer in layers if layer[0].shape == shape]))
+        if self.__cache is not None:
+            self.__cache.put(self.__name, level, x, y, tile)
+        return tile
+
+    def close(self):
+        self.__pool.shutdown(wait=False)
+        for source in self.__reprojected:
+            source.close()
@@ -0,0 +1,81 @@
+import argparse
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .TmsCatalog import iter_services
+from .TmsTab import generate_tile_tab_file, tab_filename
+
+
+DEFAULT_WORKERS = 8
+
+
+class CatalogExporter:
+    """Writes TAB+XML pairs for (category name, service) pairs into a directory."""
+
+    def __init__(self, services, directory, workers=DEFAULT_WORKERS) -> None:
+        self.__services = list(services)
+        self.__directory = directory
+        self.__workers = workers
+        self.__cancelled = threading.Event()
+        self.errors = []
+
+    def cancel(self):
+        self.__cancelled.set()
+
+    def __export(self, category, data):
+        if self.__cancelled.is_set():
+            return None
+        fn = os.path.join(self.__directory, tab_filename(category, data))
+        generate_tile_tab_file(fn, data)
+        return fn
+
+    def run(self, progress=None):
+        # progress(done, total) is called from the calling thread; returns the written TAB files
+        os.makedirs(self.__directory, exist_ok=True)
+        files = []
+        with ThreadPoolExecutor(max_workers=self.__workers) as pool:
+            futures = {pool.submit(self.__export, category, data): data.name for category, data in self.__services}
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    fn = future.result()
+                    if fn is not None:
+                        files.append(fn)
+                except Exception as error:
+                    self.errors.append('{}: {}'.format(futures[future], error))
+                if progress is not None:
+                    progress(done, len(futures))
+        return sorted(files)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write MapInfo TAB files for the catalog services')
+    parser.add_argument('catalog', help='ListTileServices_*.json file')
+    parser.add_argument('directory', help='output directory')
+    parser.add_argument('--category', action='append', help='export only this category (can be repeated)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--gateway', help='write the urls of the services served by this tile gateway, e.g. http://127.0.0.1:8765')
+    args = parser.parse_args(argv)
+
+    with open(args.catalog, 'r', encoding='UTF-8') as f:
+        catalog = json.load(f)
+    services = [(category, data) for category, data in iter_services(catalog)
+                if args.category is None or category in args.category]
+    if args.gateway is not None:
+        from .TmsGateway import GatewayClient
+        gateway = GatewayClient(args.gateway)
+        gateway.load()
+        services = [(category, gateway.data(data) or data) for category, data in services]
+    services = [(category, data) for category, data in services if data.type_service == 'tms']
+    exporter = CatalogExporter(services, args.directory, args.workers)
+    files = exporter.run()
+    for error in exporter.errors:
+        print(error, file=sys.stderr)
+    print('Written: {}, failed: {}'.format(len(files), len(exporter.errors)), file=sys.stderr)
+    return 0 if not exporter.errors else 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
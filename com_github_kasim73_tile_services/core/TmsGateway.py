@@ -0,0 +1,340 @@
+import argparse
+import asyncio
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPException
+from urllib.parse import quote, unquote, urlsplit
+
+from .TmsUrl import UrlTemplate
+from .TmsHttp import scheduler, service_headers
+from .TmsCatalog import iter_services
+from .TmsComposite import CompositeSource, resolve_members, composite_levels
+from .TmsReproject import ReprojectedSource, source_eccentricity, resampling_available
+from .TmsServer import PATH_RE, CONTENT_TYPES
+from .TmsImage import image_format
+from .TmsMetrics import metrics
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_WORKERS = 16
+DEFAULT_CACHE_SIZE = 2048
+# Seconds an idle keep-alive connection is kept open
+IDLE_TIMEOUT = 60
+# Seconds between the requests of the service list by a client
+REFRESH_INTERVAL = 60
+# Timeout of the request of the service list, seconds
+LIST_TIMEOUT = 2
+# Service attributes the service list of the gateway can override
+OVERRIDES = ('min_level', 'max_level', 'prj')
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 502: 'Bad Gateway'}
+
+
+def gateway_url_template(base_url, name):
+    return '{}/{}/{{LEVEL}}/{{ROW}}/{{COL}}.png'.format(base_url.rstrip('/'), quote(name, safe=''))
+
+
+def gateway_data(data, base_url, overrides):
+    # Service pointing at the gateway, changed by the overrides from the service list of the gateway.
+    # Headers and request limits are applied by the gateway.
+    changes = {key: value for key, value in overrides.items() if key in OVERRIDES}
+    return data.replace(url=gateway_url_template(base_url, data.name), type_address='xyz', members=None,
+                        header=None, connections=None, rate=None, **changes)
+
+
+def served_services(services):
+    # {name: overrides of the service attributes} of the services the gateway can serve
+    result = {}
+    for name, data in services.items():
+        try:
+            if data.type_service == 'composite':
+                low, high = composite_levels(data, resolve_members(data, services))
+                # Composite and reprojected tiles are Web Mercator whatever the members are
+                result[name] = {'min_level': low, 'max_level': high, 'prj': None}
+            elif source_eccentricity(data) is not None and resampling_available():
+                result[name] = {'prj': None}
+            else:
+                result[name] = {}
+        except ValueError as error:
+            print('Service {}: {}'.format(name, error), file=sys.stderr)
+    return result
+
+
+class UpstreamSource:
+    """Tiles of a service as they are, taken from the cache or downloaded on a miss."""
+
+    def __init__(self, data, cache=None) -> None:
+        self.__name = data.name
+        self.__template = UrlTemplate(data)
+        self.__headers = service_headers(data)
+        self.__cache = cache
+        self.min_level = data.min_level
+        self.max_level = data.max_level
+        scheduler().configure_service(data)
+        if cache is not None:
+            cache.set_live_time(self.__name, data.live_time)
+
+    @property
+    def name(self):
+        return self.__name
+
+    def tile(self, level, x, y, background=False):
+        if self.__cache is not None:
+            tile = self.__cache.get(self.__name, level, x, y)
+            if tile is not None:
+                return tile
+        tile = scheduler().get(self.__template.url(level, x, y), self.__headers, service=self.__name,
+                               background=background)
+        if self.__cache is not None:
+            self.__cache.put(self.__name, level, x, y, tile)
+        return tile
+
+    def close(self):
+        pass
+
+
+class TileGateway:
+    """Asyncio HTTP tile gateway shared by all Axioma sessions of a machine.
+
+    Serves every service of its catalogs from one tile cache: plain services
+    are passed through, composite and elliptical Mercator services are made
+    by the plugin sources. Concurrent requests for the same tile, from any
+    number of clients, wait for one fetch. Tiles are fetched in a thread pool
+    through the shared HTTP scheduler, so the upstream limits of the catalog
+    hold for the whole machine.
+    """
+
+    def __init__(self, services, cache=None, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=DEFAULT_WORKERS) -> None:
+        self.__services = {data.name: data for data in services}
+        self.__served = served_services(self.__services)
+        self.__cache = cache
+        self.__sources = {}
+        self.__lock = threading.Lock()
+        self.__inflight = {}
+        self.__clients = {}
+        self.__pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='TmsGateway')
+        self.__loop = asyncio.new_event_loop()
+        self.__server = self.__loop.run_until_complete(asyncio.start_server(self.__client, host, port))
+        self.__thread = threading.Thread(target=self.__loop.run_forever, name='TmsGateway', daemon=True)
+        self.__thread.start()
+        self.coalesced = 0
+
+    @property
+    def port(self):
+        return self.__server.sockets[0].getsockname()[1]
+
+    @property
+    def services(self):
+        return self.__served
+
+    def __source(self, name):
+        with self.__lock:
+            source = self.__sources.get(name)
+            if source is None:
+                data = self.__services[name]
+                if data.type_service == 'composite':
+                    source = CompositeSource(data, resolve_members(data, self.__services), self.__cache)
+                elif source_eccentricity(data) is not None and resampling_available():
+                    source = ReprojectedSource(data, self.__cache)
+                else:
+                    source = UpstreamSource(data, self.__cache)
+                self.__sources[name] = source
+            return source
+
+    def __tile(self, name, level, x, y):
+        # Runs in the thread pool
+        start = time.perf_counter()
+        try:
+            tile = self.__source(name).tile(level, x, y)
+        except Exception as error:
+            metrics().inc('tms_served_errors_total', service=name)
+            print('Tile {} {}/{}/{}: {}'.format(name, level, x, y, error), file=sys.stderr)
+            raise
+        metrics().observe('tms_served_seconds', time.perf_counter() - start, service=name)
+        return tile
+
+    async def __fetch(self, name, level, x, y):
+        key = (name, level, x, y)
+        future = self.__inflight.get(key)
+        if future is None:
+            future = self.__loop.run_in_executor(self.__pool, self.__tile, name, level, x, y)
+            self.__inflight[key] = future
+            future.add_done_callback(lambda f: self.__done(key, f))
+        else:
+            self.coalesced += 1
+            metrics().inc('tms_gateway_coalesced_total', service=name)
+        # A client that disconnects does not cancel the fetch other clients wait for
+        return await asyncio.shield(future)
+
+    def __done(self, key, future):
+        del self.__inflight[key]
+        if not future.cancelled():
+            future.exception()
+
+    async def __handle(self, method, target):
+        # (status, content type, body)
+        if method not in ('GET', 'HEAD'):
+            return 405, 'text/plain', b''
+        path = urlsplit(target).path
+        if path == '/services.json':
+            return 200, 'application/json', json.dumps(self.__served).encode('utf-8')
+        if path == '/metrics':
+            return 200, 'text/plain; version=0.0.4', metrics().to_prometheus().encode('utf-8')
+        m = PATH_RE.match(path)
+        name = unquote(m.group(1)) if m is not None else None
+        if name not in self.__served:
+            return 404, 'text/plain', b''
+        try:
+            tile = await self.__fetch(name, int(m.group(2)), int(m.group(3)), int(m.group(4)))
+        except Exception:
+            return 502, 'text/plain', b''
+        return 200, CONTENT_TYPES[image_format(tile)], tile
+
+    async def __client(self, reader, writer):
+        self.__clients[asyncio.current_task()] = writer
+        try:
+            while True:
+                line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+                if not line:
+                    break
+                headers = {}
+                while True:
+                    header = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = header.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                parts = line.decode('latin-1').split()
+                if len(parts) != 3:
+                    self.__respond(writer, 400, 'text/plain', b'', False, False)
+                    break
+                method, target, version = parts
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                status, content_type, body = await self.__handle(method, target)
+                self.__respond(writer, status, content_type, body, keep_alive, method == 'HEAD')
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.__clients.pop(asyncio.current_task(), None)
+            writer.close()
+
+    @staticmethod
+    def __respond(writer, status, content_type, body, keep_alive, head):
+        lines = ['HTTP/1.1 {} {}'.format(status, REASONS[status]),
+                 'Content-Type: {}'.format(content_type),
+                 'Content-Length: {}'.format(len(body)),
+                 'Connection: {}'.format('keep-alive' if keep_alive else 'close')]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if not head:
+            writer.write(body)
+
+    async def __shutdown(self):
+        # Closed connections end their keep-alive loops
+        self.__server.close()
+        clients = dict(self.__clients)
+        for writer in clients.values():
+            writer.close()
+        if clients:
+            await asyncio.wait(clients, timeout=1)
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.__shutdown(), self.__loop).result()
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join()
+        self.__loop.close()
+        self.__pool.shutdown(wait=False)
+        for source in self.__sources.values():
+            source.close()
+
+
+class GatewayClient:
+    """Rewrites catalog services to be opened through a tile gateway.
+
+    The list of served services is requested from the gateway in a
+    background thread and refreshed every REFRESH_INTERVAL seconds; until
+    it arrives, while the gateway is not available, or when it does not know
+    a service, the service is opened directly.
+    """
+
+    def __init__(self, base_url, refresh=REFRESH_INTERVAL) -> None:
+        self.__base_url = base_url.rstrip('/')
+        self.__refresh = refresh
+        self.__lock = threading.Lock()
+        self.__services = {}
+        self.__loaded = None
+        self.__thread = None
+
+    @property
+    def base_url(self):
+        return self.__base_url
+
+    def load(self):
+        # Requests the service list in the calling thread
+        try:
+            response = scheduler().request(self.__base_url + '/services.json', timeout=LIST_TIMEOUT, retries=0)
+            services = json.loads(response.body) if response.status == 200 else {}
+            if not isinstance(services, dict):
+                raise ValueError('unexpected service list')
+        except (OSError, ValueError, HTTPException) as error:
+            print('Tile gateway {}: {}'.format(self.__base_url, error), file=sys.stderr)
+            services = {}
+        with self.__lock:
+            self.__services = services
+            self.__loaded = time.monotonic()
+        return services
+
+    def services(self):
+        # The last known service list, never blocks; an outdated list is requested again
+        with self.__lock:
+            outdated = self.__loaded is None or time.monotonic() - self.__loaded > self.__refresh
+            if outdated and (self.__thread is None or not self.__thread.is_alive()):
+                self.__thread = threading.Thread(target=self.load, name='TmsGatewayClient', daemon=True)
+                self.__thread.start()
+            return self.__services
+
+    def data(self, data):
+        # Service pointing at the gateway, None when the service is to be opened directly
+        overrides = self.services().get(data.name)
+        if overrides is None:
+            return None
+        return gateway_data(data, self.__base_url, overrides)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the catalog services through one local tile cache')
+    parser.add_argument('catalogs', nargs='+', help='ListTileServices_*.json files, later ones replace services by name')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--cache', help='tile cache file (TileCache.mbtiles by default)')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE, help='tile cache size, MB')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    args = parser.parse_args(argv)
+
+    from .TmsCache import TileCache
+    from .TmsUtils import cache_filename
+    services = {}
+    for fn in args.catalogs:
+        with open(fn, 'r', encoding='UTF-8') as f:
+            services.update((data.name, data) for _, data in iter_services(json.load(f)))
+    cache = TileCache(args.cache or cache_filename(), args.cache_size * 1024 * 1024)
+    gateway = TileGateway(services.values(), cache, args.host, args.port, args.workers)
+    print('Serving {} services on http://{}:{}'.format(len(gateway.services), args.host, gateway.port), file=sys.stderr)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        gateway.stop()
+        cache.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
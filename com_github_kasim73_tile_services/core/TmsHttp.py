@@ -0,0 +1,410 @@
+import base64
+import random
+import threading
+import time
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from urllib.parse import urljoin, urlsplit, unquote
+from urllib.request import getproxies, proxy_bypass
+
+from .TmsUtils import DownloadCancelled
+from .TmsUrl import UrlTemplate
+from .TmsMetrics import metrics
+
+
+USER_AGENT = 'Mozilla/5.0'
+DEFAULT_TIMEOUT = 30
+DEFAULT_CONNECTIONS = 4
+DEFAULT_RETRIES = 3
+BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+MAX_REDIRECTS = 3
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+READ_CHUNK = 16384
+
+
+class HttpError(Exception):
+
+    def __init__(self, url, status) -> None:
+        super().__init__('HTTP {} {}'.format(status, url))
+        self.url = url
+        self.status = status
+
+
+class Response:
+
+    def __init__(self, url, status, headers, body, timings) -> None:
+        self.url = url
+        self.status = status
+        # Lower-case header names
+        self.headers = headers
+        self.body = body
+        # 'connect', 'ttfb' and 'transfer' in seconds, summed over redirects and retries
+        self.timings = timings
+
+
+def service_headers(data):
+    headers = {'User-Agent': USER_AGENT}
+    if data.header is not None:
+        headers.update(data.header)
+    return headers
+
+
+def service_hosts(data):
+    template = UrlTemplate(data)
+    return {urlsplit(template.url(0, 0, 0, mirror)).netloc for mirror in template.mirrors}
+
+
+def backoff_delay(attempt, retry_after=None):
+    # Retry-After in seconds is honoured, otherwise exponential backoff with full jitter around it
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), MAX_BACKOFF)
+        except ValueError:
+            pass
+    return min(MAX_BACKOFF, BACKOFF * (1 << attempt)) * random.uniform(0.5, 1.5)
+
+
+def host_proxy(scheme, netloc, proxies=None):
+    # Proxy url of a host from the environment and the system settings, None for a direct connection
+    proxies = getproxies() if proxies is None else proxies
+    proxy = proxies.get(scheme)
+    if not proxy or proxy_bypass(netloc):
+        return None
+    return proxy if '://' in proxy else 'http://' + proxy
+
+
+def proxy_authorization(proxy):
+    # Proxy-Authorization header of the credentials of a proxy url
+    parts = urlsplit(proxy)
+    if parts.username is None:
+        return {}
+    credentials = '{}:{}'.format(unquote(parts.username), unquote(parts.password or ''))
+    return {'Proxy-Authorization': 'Basic ' + base64.b64encode(credentials.encode('utf-8')).decode('ascii')}
+
+
+class HostPool:
+    """Keep-alive connections of one host with a concurrency and a request rate limit.
+
+    Through an http proxy plain http requests are sent to the proxy with an
+    absolute url, https requests go through a CONNECT tunnel. Background
+    requests wait while foreground requests are waiting for a slot and leave
+    one slot of the host free.
+    """
+
+    def __init__(self, scheme, netloc, proxy=None, connections=DEFAULT_CONNECTIONS, rate=0) -> None:
+        self.__scheme = scheme
+        self.__netloc = netloc
+        self.__proxy = urlsplit(proxy) if proxy is not None else None
+        self.headers = proxy_authorization(proxy) if proxy is not None and scheme != 'https' else {}
+        self.__lock = threading.Lock()
+        self.__idle = []
+        self.__next_start = 0.0
+        self.__slots = threading.Condition()
+        self.__busy = 0
+        self.__waiting = 0
+        self.configure(connections, rate)
+
+    def configure(self, connections, rate):
+        # Requests in flight keep their slots
+        with self.__slots:
+            self.connections = connections
+            self.rate = rate
+            self.__slots.notify_all()
+
+    def __free(self, background):
+        if background:
+            return not self.__waiting and self.__busy < max(self.connections - 1, 1)
+        return self.__busy < self.connections
+
+    def take_slot(self, background=False):
+        with self.__slots:
+            if not background:
+                self.__waiting += 1
+            try:
+                while not self.__free(background):
+                    self.__slots.wait()
+            finally:
+                if not background:
+                    self.__waiting -= 1
+            self.__busy += 1
+
+    def release_slot(self):
+        with self.__slots:
+            self.__busy -= 1
+            self.__slots.notify_all()
+
+    def wait_turn(self):
+        if not self.rate:
+            return
+        with self.__lock:
+            now = time.monotonic()
+            start = max(now, self.__next_start)
+            self.__next_start = start + 1.0 / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+    def acquire(self, timeout, fresh=False):
+        # Returns (connection, reused); a fresh connection is never an idle one
+        if not fresh:
+            with self.__lock:
+                if self.__idle:
+                    return self.__idle.pop(), True
+        return self.__connect(timeout), False
+
+    def __connect(self, timeout):
+        if self.__proxy is None:
+            cls = HTTPSConnection if self.__scheme == 'https' else HTTPConnection
+            return cls(self.__netloc, timeout=timeout)
+        if self.__scheme == 'https':
+            conn = HTTPSConnection(self.__proxy.netloc.rpartition('@')[2], timeout=timeout)
+            conn.set_tunnel(self.__netloc, headers=proxy_authorization(self.__proxy.geturl()))
+            return conn
+        return HTTPConnection(self.__proxy.netloc.rpartition('@')[2], timeout=timeout)
+
+    def target(self, path):
+        # Request target of a path: the absolute url for an http proxy
+        if self.__proxy is not None and self.__scheme != 'https':
+            return '{}://{}{}'.format(self.__scheme, self.__netloc, path)
+        return path
+
+    def release(self, conn):
+        with self.__lock:
+            if len(self.__idle) < self.connections:
+                self.__idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.__lock:
+            idle, self.__idle = self.__idle, []
+        for conn in idle:
+            conn.close()
+
+
+class _Call:
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class HttpScheduler:
+    """Shared HTTP client of the plugin.
+
+    Connections are pooled per host, every host has its own concurrency and
+    rate limit (set from the `limits` of catalog services), identical GET
+    requests in flight are coalesced into one, and 429/5xx answers and
+    connection errors are retried with jittered exponential backoff.
+    """
+
+    def __init__(self, connections=DEFAULT_CONNECTIONS, retries=DEFAULT_RETRIES) -> None:
+        self.__connections = connections
+        self.__retries = retries
+        self.__lock = threading.Lock()
+        self.__pools = {}
+        self.__proxies = {}
+        self.__limits = {}
+        self.__calls = {}
+        self.coalesced = 0
+        self.retried = 0
+
+    def configure_host(self, netloc, connections=None, rate=None):
+        with self.__lock:
+            limits = self.__limits.get(netloc, (self.__connections, 0))
+            limits = (connections or limits[0], rate if rate is not None else limits[1])
+            self.__limits[netloc] = limits
+            for (_, pool_netloc, _), pool in self.__pools.items():
+                if pool_netloc == netloc:
+                    pool.configure(*limits)
+
+    def configure_service(self, data):
+        if data.connections is not None or data.rate is not None:
+            for netloc in service_hosts(data):
+                self.configure_host(netloc, data.connections, data.rate)
+
+    def __proxy(self, scheme, netloc):
+        # Proxies are resolved once per host, the system settings may be slow to read
+        key = (scheme, netloc)
+        with self.__lock:
+            if key in self.__proxies:
+                return self.__proxies[key]
+        proxy = host_proxy(scheme, netloc)
+        with self.__lock:
+            self.__proxies[key] = proxy
+        return proxy
+
+    def __pool(self, scheme, netloc):
+        proxy = self.__proxy(scheme, netloc)
+        with self.__lock:
+            pool = self.__pools.get((scheme, netloc, proxy))
+            if pool is None:
+                limits = self.__limits.get(netloc, (self.__connections, 0))
+                pool = HostPool(scheme, netloc, proxy, *limits)
+                self.__pools[(scheme, netloc, proxy)] = pool
+            return pool
+
+    def __send(self, pool, path, headers, timeout, timings, progress, cancelled, fresh):
+        # One attempt on a pooled connection; a stale keep-alive connection is replaced once.
+        # A fresh connection is closed after the request.
+        while True:
+            conn, reused = pool.acquire(timeout, fresh)
+            try:
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                else:
+                    start = time.perf_counter()
+                    conn.connect()
+                    timings['connect'] += time.perf_counter() - start
+                start = time.perf_counter()
+                if pool.headers:
+                    headers = dict(headers, **pool.headers)
+                conn.request('GET', pool.target(path), headers=headers)
+                response = conn.getresponse()
+                first_byte = time.perf_counter()
+                if progress is None and cancelled is None:
+                    body = response.read()
+                else:
+                    body = self.__read(response, progress, cancelled)
+                timings['ttfb'] += first_byte - start
+                timings['transfer'] += time.perf_counter() - first_byte
+            except (ConnectionError, HTTPException):
+                conn.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            if response.will_close or fresh:
+                conn.close()
+            else:
+                pool.release(conn)
+            return response, body
+
+    @staticmethod
+    def __read(response, progress, cancelled):
+        total = int(response.getheader('Content-Length') or 0)
+        chunks = []
+        received = 0
+        while True:
+            if cancelled is not None and cancelled.is_set():
+                raise DownloadCancelled()
+            chunk = response.read(READ_CHUNK)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            received += len(chunk)
+            if progress is not None:
+                progress(received, total)
+        return b''.join(chunks)
+
+    def request(self, url, headers=None, timeout=DEFAULT_TIMEOUT, retries=None, progress=None, cancelled=None,
+                fresh=False, background=False):
+        # Returns the final Response of any status; redirects are followed.
+        # Setting the `cancelled` event stops the request between attempts, in the backoff and while reading.
+        # With `fresh` the request opens its own connection, so that the connect time is measured.
+        # A `background` request gives way to the other requests to its host (see HostPool).
+        retries = self.__retries if retries is None else retries
+        headers = headers or {'User-Agent': USER_AGENT}
+        timings = {'connect': 0.0, 'ttfb': 0.0, 'transfer': 0.0}
+        attempt = 0
+        redirects = 0
+        while True:
+            if cancelled is not None and cancelled.is_set():
+                raise DownloadCancelled()
+            parts = urlsplit(url)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            pool = self.__pool(parts.scheme, parts.netloc)
+            retry_after = None
+            pool.take_slot(background)
+            try:
+                pool.wait_turn()
+                try:
+                    response, body = self.__send(pool, path, headers, timeout, timings, progress, cancelled, fresh)
+                except (OSError, HTTPException):
+                    if attempt >= retries:
+                        raise
+                    response = None
+                if response is not None:
+                    status = response.status
+                    retry_after = response.getheader('Retry-After')
+            finally:
+                pool.release_slot()
+            if response is not None:
+                if status in REDIRECT_STATUSES and response.getheader('Location') and redirects < MAX_REDIRECTS:
+                    url = urljoin(url, response.getheader('Location'))
+                    redirects += 1
+                    continue
+                if status not in RETRY_STATUSES or attempt >= retries:
+                    return Response(url, status, {k.lower(): v for k, v in response.getheaders()}, body, timings)
+            self.retried += 1
+            metrics().inc('tms_http_retries_total', host=parts.netloc)
+            delay = backoff_delay(attempt, retry_after)
+            if cancelled is None:
+                time.sleep(delay)
+            elif cancelled.wait(delay):
+                raise DownloadCancelled()
+            attempt += 1
+
+    def get(self, url, headers=None, timeout=DEFAULT_TIMEOUT, retries=None, service=None, background=False):
+        # Body of a successful GET; concurrent calls for the same url and headers share one request.
+        # The tile traffic metrics are labelled by the service name or by the host.
+        key = (url, tuple(sorted((headers or {}).items())))
+        with self.__lock:
+            call = self.__calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.__calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        label = service or urlsplit(url).netloc
+        if not leader:
+            metrics().inc('tms_http_coalesced_total', service=label)
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        registry = metrics()
+        registry.inc('tms_tile_requests_total', service=label)
+        start = time.perf_counter()
+        try:
+            response = self.request(url, headers, timeout, retries, background=background)
+            if not 200 <= response.status < 300:
+                raise HttpError(url, response.status)
+            registry.observe('tms_tile_latency_seconds', time.perf_counter() - start, service=label)
+            registry.inc('tms_tile_bytes_total', len(response.body), service=label)
+            call.result = response.body
+            return call.result
+        except Exception as error:
+            registry.inc('tms_tile_errors_total', service=label)
+            call.error = error
+            raise
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+            call.event.set()
+
+    def close(self):
+        with self.__lock:
+            pools, self.__pools = list(self.__pools.values()), {}
+            self.__proxies = {}
+        for pool in pools:
+            pool.close()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def scheduler():
+    # The scheduler shared by all downloads of the process
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = HttpScheduler()
+        return _scheduler
@@ -0,0 +1,95 @@
+import struct
+import zlib
+from importlib.util import find_spec
+
+
+JPEG_QUALITY = 90
+
+# Decoder and encoder of the host application (e.g. QImage based), used when Pillow is not installed
+_decoder = None
+_encoder = None
+
+
+def set_decoder(decoder):
+    # decoder(bytes) -> RGBA uint8 numpy array of shape (height, width, 4)
+    global _decoder
+    _decoder = decoder
+
+
+def set_encoder(encoder):
+    # encoder(rgba, format, quality) -> bytes, the format is 'jpg'
+    global _encoder
+    _encoder = encoder
+
+
+def has_decoder():
+    return _decoder is not None or find_spec('PIL') is not None
+
+
+def image_format(tile):
+    if tile.startswith(b'\xff\xd8'):
+        return 'jpg'
+    if tile[:4] == b'RIFF' and tile[8:12] == b'WEBP':
+        return 'webp'
+    return 'png'
+
+
+def decode_image(data):
+    if _decoder is not None:
+        return _decoder(data)
+    try:
+        from PIL import Image
+    except ImportError:
+        raise RuntimeError('Decoding tiles requires Pillow or a registered image decoder')
+    import io
+    import numpy as np
+    with Image.open(io.BytesIO(data)) as image:
+        return np.asarray(image.convert('RGBA'))
+
+
+def encode_jpeg(rgba, quality=JPEG_QUALITY):
+    # JPEG of an opaque RGBA array, None when no encoder is available
+    if _encoder is not None:
+        return _encoder(rgba, 'jpg', quality)
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    import io
+    out = io.BytesIO()
+    Image.fromarray(rgba[..., :3]).save(out, format='JPEG', quality=quality)
+    return out.getvalue()
+
+
+def encode_png(rgba, level=6):
+    # RGBA uint8 array to PNG without any imaging library
+    import numpy as np
+    height, width = rgba.shape[:2]
+    raw = np.empty((height, width * 4 + 1), dtype=np.uint8)
+    raw[:, 0] = 0
+    raw[:, 1:] = rgba.reshape(height, width * 4)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(raw.tobytes(), level)) + chunk(b'IEND', b''))
+
+
+def blend(layers):
+    # Alpha-blends (rgba, opacity) layers bottom to top with the "over" operator
+    import numpy as np
+    out_rgb = None
+    for rgba, opacity in layers:
+        rgba = rgba.astype(np.float32) / 255.0
+        alpha = rgba[..., 3:] * opacity
+        if out_rgb is None:
+            out_rgb = rgba[..., :3] * alpha
+            out_alpha = alpha
+            continue
+        out_rgb = rgba[..., :3] * alpha + out_rgb * (1.0 - alpha)
+        out_alpha = alpha + out_alpha * (1.0 - alpha)
+    # Premultiplied accumulation back to straight alpha
+    rgb = np.divide(out_rgb, out_alpha, out=np.zeros_like(out_rgb), where=out_alpha > 0)
+    result = np.concatenate((rgb, out_alpha), axis=2)
+    return (np.clip(result, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
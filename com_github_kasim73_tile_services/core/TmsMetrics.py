@@ -0,0 +1,202 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from .TmsUtils import replace_file
+
+
+# Upper bounds in seconds of the histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DEFAULT_INTERVAL = 60
+
+
+class Histogram:
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # Linear interpolation inside the bucket holding the quantile, as Prometheus does
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                low = BUCKETS[i - 1] if i > 0 else 0.0
+                high = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return low + (high - low) * (rank - seen) / n
+            seen += n
+        return BUCKETS[-1]
+
+
+class Metrics:
+    """Counters and duration histograms of the plugin, labelled by service, host or operation.
+
+    Names follow the Prometheus conventions, so the registry can be written
+    both as JSON and as a text file for the node exporter textfile collector.
+    """
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__counters = {}
+        self.__histograms = {}
+        self.started = time.time()
+        self.version = 0
+
+    @staticmethod
+    def __key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self.__key(name, labels)
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + value
+            self.version += 1
+
+    def observe(self, name, value, **labels):
+        key = self.__key(name, labels)
+        with self.__lock:
+            histogram = self.__histograms.get(key)
+            if histogram is None:
+                histogram = self.__histograms[key] = Histogram()
+            histogram.observe(value)
+            self.version += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter(self, name, **labels):
+        with self.__lock:
+            return self.__counters.get(self.__key(name, labels), 0)
+
+    def histogram(self, name, **labels):
+        with self.__lock:
+            return self.__histograms.get(self.__key(name, labels))
+
+    def series(self, name):
+        # (labels dict, counter value or Histogram) of all series of a metric
+        with self.__lock:
+            items = list(self.__counters.items()) + list(self.__histograms.items())
+        return [(dict(labels), value) for (n, labels), value in items if n == name]
+
+    def services(self):
+        # Summary per service of the tile traffic and the tile cache
+        result = {}
+        for labels, value in self.series('tms_tile_requests_total'):
+            result.setdefault(labels['service'], {})['requests'] = value
+        for labels, value in self.series('tms_tile_errors_total'):
+            result.setdefault(labels['service'], {})['errors'] = value
+        for labels, value in self.series('tms_tile_bytes_total'):
+            result.setdefault(labels['service'], {})['bytes'] = value
+        for labels, value in self.series('tms_cache_hits_total'):
+            result.setdefault(labels['service'], {})['cache_hits'] = value
+        for labels, value in self.series('tms_cache_misses_total'):
+            result.setdefault(labels['service'], {})['cache_misses'] = value
+        for labels, histogram in self.series('tms_tile_latency_seconds'):
+            service = result.setdefault(labels['service'], {})
+            service['latency_p50'] = histogram.quantile(0.5)
+            service['latency_p95'] = histogram.quantile(0.95)
+        for service in result.values():
+            lookups = service.get('cache_hits', 0) + service.get('cache_misses', 0)
+            service['cache_hit_ratio'] = service.get('cache_hits', 0) / lookups if lookups else None
+        return result
+
+    def to_json(self):
+        with self.__lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self.__counters.items())]
+            histograms = [{'name': name, 'labels': dict(labels), 'count': h.count, 'sum': h.sum,
+                           'buckets': dict(zip([str(b) for b in BUCKETS] + ['+Inf'], h.counts))}
+                          for (name, labels), h in sorted(self.__histograms.items())]
+        report = {'time': time.time(), 'started': self.started, 'counters': counters,
+                  'histograms': histograms, 'services': self.services()}
+        return json.dumps(report, indent=1)
+
+    def to_prometheus(self):
+        def labels_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                  for k, v in pairs) + '}'
+
+        lines = []
+        with self.__lock:
+            counters = sorted(self.__counters.items())
+            histograms = sorted(self.__histograms.items())
+            typed = set()
+            for (name, labels), value in counters:
+                if name not in typed:
+                    typed.add(name)
+                    lines.append('# TYPE {} counter'.format(name))
+                lines.append('{}{} {}'.format(name, labels_text(labels), value))
+            for (name, labels), h in histograms:
+                if name not in typed:
+                    typed.add(name)
+                    lines.append('# TYPE {} histogram'.format(name))
+                total = 0
+                for bound, n in zip([repr(b) for b in BUCKETS] + ['+Inf'], h.counts):
+                    total += n
+                    lines.append('{}_bucket{} {}'.format(name, labels_text(labels, [('le', bound)]), total))
+                lines.append('{}_sum{} {}'.format(name, labels_text(labels), h.sum))
+                lines.append('{}_count{} {}'.format(name, labels_text(labels), h.count))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, json_file=None, prometheus_file=None):
+        if json_file is not None:
+            replace_file(json_file, self.to_json().encode('utf-8'))
+        if prometheus_file is not None:
+            replace_file(prometheus_file, self.to_prometheus().encode('utf-8'))
+
+
+class MetricsWriter:
+    """Writes the metrics every `interval` seconds while they keep changing."""
+
+    def __init__(self, registry, json_file, prometheus_file, interval=DEFAULT_INTERVAL) -> None:
+        self.__registry = registry
+        self.__files = (json_file, prometheus_file)
+        self.__interval = interval
+        self.__stopped = threading.Event()
+        self.__written = None
+        self.__thread = threading.Thread(target=self.__run, name='TmsMetrics', daemon=True)
+        self.__thread.start()
+
+    def __write(self):
+        if self.__registry.version != self.__written:
+            self.__written = self.__registry.version
+            try:
+                self.__registry.write(*self.__files)
+            except OSError as error:
+                print('Metrics are not written:', error)
+
+    def __run(self):
+        while not self.__stopped.wait(self.__interval):
+            self.__write()
+
+    def stop(self):
+        self.__stopped.set()
+        self.__thread.join()
+        self.__write()
+
+
+_metrics = Metrics()
+
+
+def metrics():
+    # The registry shared by the whole plugin
+    return _metrics
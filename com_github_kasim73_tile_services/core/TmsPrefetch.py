@@ -0,0 +1,152 @@
+import math
+import sys
+import threading
+import time
+from collections import deque
+
+from .TmsUrl import MERCATOR_EXTENT
+
+
+DEFAULT_WORKERS = 2
+DEFAULT_BANDWIDTH = 512 * 1024
+TILE_PIXELS = 256
+
+
+def level_for_view(width_m, width_px, data):
+    # Level whose resolution is the closest to the view resolution, clamped to the service levels
+    resolution = width_m / max(width_px, 1)
+    level = round(math.log2(2 * MERCATOR_EXTENT / (TILE_PIXELS * resolution)))
+    return min(max(level, data.min_level), data.max_level)
+
+
+def mercator_tile_range(bbox, level):
+    # bbox in EPSG:3857 meters (xmin, ymin, xmax, ymax); returns inclusive x0, y0, x1, y1
+    n = 1 << level
+    size = 2 * MERCATOR_EXTENT / n
+
+    def clamp(v):
+        return min(max(v, 0), n - 1)
+
+    return (clamp(int((bbox[0] + MERCATOR_EXTENT) // size)), clamp(int((MERCATOR_EXTENT - bbox[3]) // size)),
+            clamp(int((bbox[2] + MERCATOR_EXTENT) // size)), clamp(int((MERCATOR_EXTENT - bbox[1]) // size)))
+
+
+def prefetch_tiles(bbox, level, data, ring=1):
+    # Tiles worth prefetching for a view, the most useful first: the ring just outside the view,
+    # the level above (few tiles) and then the level below
+    tiles = []
+    x0, y0, x1, y1 = mercator_tile_range(bbox, level)
+    n = 1 << level
+    for x in range(x0 - ring, x1 + ring + 1):
+        for y in range(y0 - ring, y1 + ring + 1):
+            if x0 <= x <= x1 and y0 <= y <= y1:
+                continue
+            if 0 <= x < n and 0 <= y < n:
+                tiles.append((level, x, y))
+    for z in (level - 1, level + 1):
+        if data.min_level <= z <= data.max_level:
+            zx0, zy0, zx1, zy1 = mercator_tile_range(bbox, z)
+            tiles.extend((z, x, y) for x in range(zx0, zx1 + 1) for y in range(zy0, zy1 + 1))
+    return tiles
+
+
+class TokenBucket:
+
+    def __init__(self, rate) -> None:
+        self.rate = rate
+        self.__lock = threading.Lock()
+        self.__allowance = rate
+        self.__last = time.monotonic()
+
+    def consume(self, amount):
+        # Blocks the caller until `amount` bytes fit into the configured rate
+        if not self.rate:
+            return
+        with self.__lock:
+            now = time.monotonic()
+            self.__allowance = min(self.rate, self.__allowance + (now - self.__last) * self.rate)
+            self.__last = now
+            self.__allowance -= amount
+            wait = -self.__allowance / self.rate if self.__allowance < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Prefetcher:
+    """Background download of tiles around the current view into a TileCache.
+
+    Tiles are taken from the same sources the tile server serves the layers
+    from (see TmsServer), so the sources put them into the cache. Each call
+    of `request` replaces the queued work; tiles of older requests still in
+    the queue are dropped, so panning away cancels stale work. Downloads are
+    background requests of the HttpScheduler, and a few daemon workers and a
+    shared bandwidth cap keep the traffic behind the host's own tile loading.
+    """
+
+    def __init__(self, cache, workers=DEFAULT_WORKERS, bandwidth=DEFAULT_BANDWIDTH) -> None:
+        self.__cache = cache
+        self.__bucket = TokenBucket(bandwidth)
+        self.__cond = threading.Condition()
+        self.__queue = deque()
+        self.__generation = 0
+        self.__stopped = False
+        self.fetched = 0
+        self.failed = 0
+        self.__threads = [threading.Thread(target=self.__work, name='TmsPrefetch', daemon=True) for _ in range(workers)]
+        for thread in self.__threads:
+            thread.start()
+
+    @property
+    def bandwidth(self):
+        return self.__bucket.rate
+
+    @bandwidth.setter
+    def bandwidth(self, value):
+        self.__bucket.rate = value
+
+    def request(self, jobs):
+        # jobs are (source, tiles) pairs replacing all queued work
+        with self.__cond:
+            self.__generation += 1
+            self.__queue.clear()
+            for source, tiles in jobs:
+                self.__queue.extend((self.__generation, source, tile) for tile in tiles)
+            self.__cond.notify_all()
+
+    def cancel(self):
+        with self.__cond:
+            self.__generation += 1
+            self.__queue.clear()
+
+    def stop(self):
+        with self.__cond:
+            self.__stopped = True
+            self.__queue.clear()
+            self.__cond.notify_all()
+        for thread in self.__threads:
+            thread.join(1)
+
+    def __next(self):
+        with self.__cond:
+            while not self.__queue and not self.__stopped:
+                self.__cond.wait()
+            if self.__stopped:
+                return None
+            return self.__queue.popleft()
+
+    def __work(self):
+        while True:
+            task = self.__next()
+            if task is None:
+                return
+            generation, source, (level, x, y) = task
+            if generation != self.__generation or self.__cache.contains(source.name, level, x, y):
+                continue
+            try:
+                tile = source.tile(level, x, y, background=True)
+            except Exception as error:
+                self.failed += 1
+                print('Prefetch {} {}/{}/{}: {}'.format(source.name, level, x, y, error), file=sys.stderr)
+                continue
+            self.fetched += 1
+            self.__bucket.consume(len(tile))
@@ -0,0 +1,132 @@
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .TmsUtils import replace_file
+from .TmsUrl import UrlTemplate, lonlat_to_tile
+from .TmsHttp import scheduler, service_headers
+
+
+DEFAULT_WORKERS = 16
+DEFAULT_TIMEOUT = 10
+DEFAULT_TTL = 30 * 60
+SLOW_LATENCY = 1.0
+# The representative tile of a service covers this point at PROBE_LEVEL (clamped to the service levels)
+PROBE_POINT = (37.6173, 55.7558)
+PROBE_LEVEL = 10
+
+
+def probe_tile(data):
+    level = min(max(PROBE_LEVEL, data.min_level), data.max_level)
+    x, y = lonlat_to_tile(PROBE_POINT[0], PROBE_POINT[1], level)
+    return level, x, y
+
+
+def probe_url(url, headers=None, timeout=DEFAULT_TIMEOUT):
+    # Times are in seconds and are summed over the redirects; a probe is never retried and does not
+    # reuse keep-alive connections, which would hide the connect time
+    result = {'url': url, 'status': None, 'connect': 0.0, 'ttfb': 0.0, 'transfer': 0.0, 'size': 0, 'error': None}
+    try:
+        response = scheduler().request(url, headers, timeout, retries=0, fresh=True)
+        result.update(response.timings)
+        result['status'] = response.status
+        result['size'] = len(response.body)
+    except Exception as error:
+        result['error'] = str(error) or error.__class__.__name__
+    return result
+
+
+def is_ok(result):
+    return result['status'] is not None and 200 <= result['status'] < 300 and result['size'] > 0
+
+
+def latency(result):
+    return result['connect'] + result['ttfb'] + result['transfer']
+
+
+class ServiceProbe:
+    """Fetches one representative tile of every service from every mirror host with bounded parallelism."""
+
+    def __init__(self, services, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT) -> None:
+        self.__services = services
+        self.__workers = workers
+        self.__timeout = timeout
+        self.__cancelled = threading.Event()
+
+    def cancel(self):
+        self.__cancelled.set()
+
+    def __probe(self, data, template, mirror):
+        if self.__cancelled.is_set():
+            return None
+        level, x, y = probe_tile(data)
+        result = probe_url(template.url(level, x, y, mirror), service_headers(data), self.__timeout)
+        result['mirror'] = mirror
+        return result
+
+    def run(self, progress=None):
+        # progress(done, total) is called from the calling thread
+        results = {data.name: [] for data in self.__services}
+        with ThreadPoolExecutor(max_workers=self.__workers) as pool:
+            futures = {}
+            for data in self.__services:
+                template = UrlTemplate(data)
+                scheduler().configure_service(data)
+                for mirror in template.mirrors:
+                    futures[pool.submit(self.__probe, data, template, mirror)] = data.name
+            done = 0
+            for future in as_completed(futures):
+                result = future.result()
+                if result is not None:
+                    results[futures[future]].append(result)
+                done += 1
+                if progress is not None:
+                    progress(done, len(futures))
+        report = {'time': time.time(), 'services': {}}
+        for name, mirror_results in results.items():
+            if not mirror_results:
+                continue
+            mirror_results.sort(key=lambda r: r['mirror'])
+            ok = [r for r in mirror_results if is_ok(r)]
+            report['services'][name] = {
+                'ok': len(ok) == len(mirror_results),
+                'available': bool(ok),
+                'latency': min(latency(r) for r in ok) if ok else None,
+                'mirrors': mirror_results
+            }
+        return report
+
+
+def save_report(file_name, report):
+    replace_file(file_name, json.dumps(report, indent=1).encode('utf-8'))
+
+
+def load_report(file_name, ttl=DEFAULT_TTL):
+    # Returns None when there is no report or it is older than ttl seconds
+    if not os.path.isfile(file_name):
+        return None
+    try:
+        with open(file_name, 'r', encoding='UTF-8') as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - report.get('time', 0) > ttl:
+        return None
+    return report
+
+
+def export_report(file_name, report):
+    # csv with one row per service mirror; any other extension is written as json
+    if not file_name.lower().endswith('.csv'):
+        save_report(file_name, report)
+        return
+    fields = ['service', 'mirror', 'url', 'status', 'connect', 'ttfb', 'transfer', 'size', 'error']
+    with open(file_name, 'w', encoding='UTF-8', newline='') as f:
+        writer = csv.DictWriter(f, fields, extrasaction='ignore')
+        writer.writeheader()
+        for name, service in sorted(report['services'].items()):
+            for result in service['mirrors']:
+                writer.writerow(dict(result, service=name))
@@ -0,0 +1,136 @@
+import argparse
+import json
+import sys
+
+from .TmsImage import decode_image, encode_png
+from .TmsService import Service
+from .TmsTranscode import FORMATS
+
+
+BATCH_SIZE = 32
+
+
+def downsample(blocks):
+    # (N, 2h, 2w, 4) uint8 RGBA blocks of 2x2 children -> (N, h, w, 4); colors are averaged
+    # with alpha weights, so transparent pixels do not darken the edges
+    import numpy as np
+    n, height, width, _ = blocks.shape
+    q = blocks.reshape(n, height // 2, 2, width // 2, 2, 4).astype(np.float32)
+    alpha = q[..., 3:4]
+    alpha_sum = alpha.sum(axis=(2, 4))
+    rgb = (q[..., :3] * alpha).sum(axis=(2, 4))
+    rgb = np.divide(rgb, alpha_sum, out=np.zeros_like(rgb), where=alpha_sum > 0)
+    out = np.concatenate((rgb, alpha_sum / 4.0), axis=-1)
+    return (np.clip(out, 0.0, 255.0) + 0.5).astype(np.uint8)
+
+
+def children_signature(ids, x, y):
+    # Content ids of the four children of tile (x, y) of the level above, empty for a missing child
+    return '|'.join(ids.get((2 * x + dx, 2 * y + dy), '') for dy in (0, 1) for dx in (0, 1))
+
+
+class PyramidBuilder:
+    """Makes the lower levels of an MBTiles file from the tiles of a higher level.
+
+    Every overview tile remembers the content ids of its children and is
+    rebuilt only when they change, so running the builder again after more
+    tiles were seeded processes only the affected branches. Tiles downloaded
+    from the provider are never replaced.
+    """
+
+    def __init__(self, file_name, data, fmt=None, quality=80) -> None:
+        self.__file_name = file_name
+        self.__data = data
+        # Overviews are PNG unless a TmsTranscode format is given
+        self.__format = fmt
+        self.__quality = quality
+        self.built = 0
+        self.unchanged = 0
+
+    def __encode(self, image):
+        tile = encode_png(image)
+        if self.__format is not None and self.__format != 'png':
+            from .TmsTranscode import transcode
+            tile = transcode(tile, self.__format, self.__quality) or tile
+        return tile
+
+    def __build(self, out, level, parents):
+        import numpy as np
+        size = None
+        blocks = []
+        for x, y, _ in parents:
+            children = [[out.get(level + 1, 2 * x + dx, 2 * y + dy) for dx in (0, 1)] for dy in (0, 1)]
+            images = [[decode_image(c) if c is not None else None for c in row] for row in children]
+            if size is None:
+                size = next(i.shape[:2] for row in images for i in row if i is not None)
+            block = np.zeros((2 * size[0], 2 * size[1], 4), dtype=np.uint8)
+            for dy, row in enumerate(images):
+                for dx, image in enumerate(row):
+                    if image is not None:
+                        block[dy * size[0]:(dy + 1) * size[0], dx * size[1]:(dx + 1) * size[1]] = image
+            blocks.append(block)
+        for (x, y, signature), image in zip(parents, downsample(np.stack(blocks))):
+            out.put_overview(level, x, y, self.__encode(image), signature)
+        out.commit()
+
+    def run(self, top_level, min_level=0, progress=None):
+        # Builds levels top_level - 1 .. min_level, clamped to the levels of the service;
+        # progress(level, done, total) is called after every batch
+        from .TmsSeed import MBTilesFile, clamp_levels
+        min_level, top_level = clamp_levels(self.__data, min_level, top_level)
+        out = MBTilesFile(self.__file_name, self.__data)
+        try:
+            for level in range(top_level - 1, min_level - 1, -1):
+                children = out.tile_ids(level + 1)
+                existing = out.tile_ids(level)
+                built = out.overview_sources(level)
+                todo = []
+                for x, y in sorted({(cx >> 1, cy >> 1) for cx, cy in children}):
+                    if (x, y) in existing and (x, y) not in built:
+                        continue
+                    signature = children_signature(children, x, y)
+                    if built.get((x, y)) == signature:
+                        self.unchanged += 1
+                        continue
+                    todo.append((x, y, signature))
+                for i in range(0, len(todo), BATCH_SIZE):
+                    self.__build(out, level, todo[i:i + BATCH_SIZE])
+                    self.built += len(todo[i:i + BATCH_SIZE])
+                    if progress is not None:
+                        progress(level, min(i + BATCH_SIZE, len(todo)), len(todo))
+            out.set_metadata('minzoom', min_level)
+        finally:
+            out.close()
+        return self.built, self.unchanged
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the lower levels of an MBTiles file from a higher level')
+    parser.add_argument('file', help='MBTiles file written by TmsSeed')
+    parser.add_argument('--top-level', type=int, required=True, help='level to build the overviews from')
+    parser.add_argument('--min-level', type=int, default=0)
+    parser.add_argument('--catalog', help='catalog to take the level range of the service from')
+    parser.add_argument('--service', help='service name in the catalog')
+    parser.add_argument('--format', choices=FORMATS, help='re-encode the overviews (requires Pillow), see TmsTranscode')
+    parser.add_argument('--quality', type=int, default=80)
+    args = parser.parse_args(argv)
+
+    # Without a catalog the file itself stands for the service, with the default levels
+    data = Service(args.service or args.file, url=args.file)
+    if args.catalog is not None:
+        from .TmsSeed import find_service
+        with open(args.catalog, 'r', encoding='UTF-8') as f:
+            data = find_service(json.load(f), args.service)
+        if data is None:
+            parser.error("service '{}' is not found".format(args.service))
+
+    def progress(level, done, total):
+        print('\rLevel {}: {}/{}'.format(level, done, total), end='', file=sys.stderr)
+
+    built, unchanged = PyramidBuilder(args.file, data, args.format, args.quality).run(args.top_level, args.min_level, progress)
+    print('\nBuilt: {}, unchanged: {}'.format(built, unchanged), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+import math
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from importlib.util import find_spec
+
+from .TmsUrl import UrlTemplate
+from .TmsHttp import scheduler, service_headers
+from .TmsImage import decode_image, encode_png, encode_jpeg, has_decoder, image_format
+
+
+DEFAULT_WORKERS = 4
+MERCATOR_RE = re.compile(r'CoordSys\s+Earth\s+Projection\s+10\s*,\s*(\d+)', re.IGNORECASE)
+# Eccentricity of the ellipsoid by MapInfo datum number
+DATUM_ECCENTRICITY = {104: 0.0818191908426215}
+
+
+def source_eccentricity(data):
+    # Eccentricity of an elliptical Mercator service, None when the service can not be reprojected
+    m = MERCATOR_RE.match(data.prj or '')
+    if m is None:
+        return None
+    return DATUM_ECCENTRICITY.get(int(m.group(1)))
+
+
+def resampling_available():
+    # Resampling needs NumPy and an image decoder; without them the services are opened as they are
+    return find_spec('numpy') is not None and has_decoder()
+
+
+@lru_cache(maxsize=1024)
+def row_lookup(level, y, e, size):
+    # Source pixel rows (global, fractional) sampled by the pixel rows of Web Mercator tile y.
+    # Both projections share x, so a tile row of the target maps to a row of the source tiles.
+    import numpy as np
+    n = size << level
+    rows = y * size + np.arange(size, dtype=np.float64) + 0.5
+    lat = np.arctan(np.sinh(math.pi * (1.0 - 2.0 * rows / n)))
+    sin = e * np.sin(lat)
+    src = np.log(np.tan(math.pi / 4 + lat / 2) * ((1.0 - sin) / (1.0 + sin)) ** (e / 2))
+    lookup = (1.0 - src / math.pi) / 2.0 * n - 0.5
+    lookup.setflags(write=False)
+    return lookup
+
+
+def resample_rows(image, rows):
+    # Linear interpolation of image rows at fractional positions
+    import numpy as np
+    rows = np.clip(rows, 0, image.shape[0] - 1)
+    i0 = np.floor(rows).astype(np.intp)
+    i1 = np.minimum(i0 + 1, image.shape[0] - 1)
+    f = (rows - i0).astype(np.float32)[:, None, None]
+    result = image[i0].astype(np.float32) * (1.0 - f) + image[i1].astype(np.float32) * f
+    return (result + 0.5).astype(np.uint8)
+
+
+class ReprojectedSource:
+    """Web Mercator tiles of an elliptical Mercator service.
+
+    Every target tile is resampled from the one or two source tiles of the
+    same column that cover its latitudes, using row lookups cached per tile
+    row and level. Opaque tiles of a JPEG service stay JPEG.
+    """
+
+    def __init__(self, data, cache=None, workers=DEFAULT_WORKERS) -> None:
+        self.__name = data.name
+        self.__template = UrlTemplate(data)
+        self.__headers = service_headers(data)
+        self.__e = source_eccentricity(data)
+        if self.__e is None:
+            raise ValueError("Coordinate system of service '{}' is not supported".format(self.__name))
+        self.__size = data.size[1]
+        self.__cache = cache
+        self.__jpeg = False
+        self.__pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='TmsReproject')
+        self.min_level = data.min_level
+        self.max_level = data.max_level
+        scheduler().configure_service(data)
+        if cache is not None:
+            cache.set_live_time(self.__name, data.live_time)
+
+    @property
+    def name(self):
+        return self.__name
+
+    def __fetch(self, level, x, y, background):
+        data = scheduler().get(self.__template.url(level, x, y), self.__headers, service=self.__name,
+                               background=background)
+        if image_format(data) == 'jpg':
+            self.__jpeg = True
+        return decode_image(data)
+
+    def __encode(self, image):
+        if self.__jpeg and image[..., 3].min() == 255:
+            tile = encode_jpeg(image)
+            if tile is not None:
+                return tile
+        return encode_png(image)
+
+    def image(self, level, x, y, background=False):
+        # RGBA array of the Web Mercator tile
+        import numpy as np
+        lookup = row_lookup(level, y, self.__e, self.__size)
+        last = (1 << level) - 1
+        first_tile = min(max(int(lookup[0]) // self.__size, 0), last)
+        last_tile = min(max(int(lookup[-1]) + 1, 0) // self.__size, last)
+        futures = [self.__pool.submit(self.__fetch, level, x, ty, background) for ty in range(first_tile, last_tile + 1)]
+        tiles = []
+        error = None
+        for future in futures:
+            try:
+                tiles.append(future.result())
+            except Exception as e:
+                error = e
+                tiles.append(None)
+        if all(tile is None for tile in tiles):
+            raise error
+        shape = next(tile.shape for tile in tiles if tile is not None)
+        # A missing source tile becomes transparent
+        stacked = np.concatenate([tile if tile is not None else np.zeros(shape, dtype=np.uint8) for tile in tiles])
+        return resample_rows(stacked, lookup - first_tile * self.__size)
+
+    def tile(self, level, x, y, background=False):
+        if self.__cache is not None:
+            tile = self.__cache.get(self.__name, level, x, y)
+            if tile is not None:
+                return tile
+        tile = self.__encode(self.image(level, x, y, background))
+        if self.__cache is not None:
+            self.__cache.put(self.__name, level, x, y, tile)
+        return tile
+
+    def close(self):
+        self.__pool.shutdown(wait=False)
@@ -0,0 +1,83 @@
+import re
+from bisect import bisect_left
+from html import unescape
+
+
+# Field weights of a matched token; a whole-token match counts twice
+FIELD_WEIGHTS = {
+    'title': 8,
+    'name': 6,
+    'category': 4,
+    'description': 1
+}
+
+TAG_RE = re.compile(r'<[^>]*>')
+TOKEN_RE = re.compile(r'\w+')
+
+
+def strip_tags(html):
+    return unescape(TAG_RE.sub(' ', html))
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower().replace('ё', 'е'))
+
+
+class SearchIndex:
+    """Inverted token index over the catalog services with prefix lookup.
+
+    Documents are (category name, service name) keys. A query matches a
+    document when every query term is a prefix of one of its tokens.
+    """
+
+    def __init__(self) -> None:
+        self.__postings = {}
+        self.__tokens = []
+
+    def build(self, catalog):
+        postings = {}
+        for cat in catalog['categories']:
+            for data in cat['services']:
+                key = (cat['name'], data.name)
+                fields = {
+                    'title': data.title or '',
+                    'name': data.name.replace('_', ' '),
+                    'category': cat['name'],
+                    'description': strip_tags(data.description or '')
+                }
+                for field, text in fields.items():
+                    weight = FIELD_WEIGHTS[field]
+                    for token in tokenize(text):
+                        docs = postings.setdefault(token, {})
+                        if docs.get(key, 0) < weight:
+                            docs[key] = weight
+        self.__postings = postings
+        self.__tokens = sorted(postings)
+
+    def __prefixed(self, prefix):
+        i = bisect_left(self.__tokens, prefix)
+        while i < len(self.__tokens) and self.__tokens[i].startswith(prefix):
+            yield self.__tokens[i]
+            i += 1
+
+    def search(self, text):
+        # Returns the matching keys ranked by score, best first; None for an empty query
+        terms = tokenize(text)
+        if not terms:
+            return None
+        scores = None
+        for term in terms:
+            term_scores = {}
+            for token in self.__prefixed(term):
+                exact = 2 if token == term else 1
+                for key, weight in self.__postings[token].items():
+                    score = weight * exact
+                    if term_scores.get(key, 0) < score:
+                        term_scores[key] = score
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {key: score + term_scores[key] for key, score in scores.items() if key in term_scores}
+            if not scores:
+                return []
+        return sorted(scores, key=lambda key: -scores[key])
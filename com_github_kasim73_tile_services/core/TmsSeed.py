@@ -0,0 +1,330 @@
+import argparse
+import json
+import sqlite3
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .TmsCatalog import iter_services
+from .TmsUrl import UrlTemplate, tile_range, tile_chunks, tile_keys, flip_rows
+from .TmsHttp import scheduler, service_headers, USER_AGENT
+from .TmsImage import image_format
+from .TmsCache import tile_hash
+from .TmsTranscode import transcode_mbtiles, transcode_settings, FORMATS
+
+
+DEFAULT_WORKERS = 8
+CHUNK_SIZE = 65536
+
+
+class MBTilesFile:
+    """MBTiles 1.3 output; rows are stored in the TMS scheme as the spec requires.
+
+    New files use the deduplicating layout of the spec: identical tiles share
+    one row of `images` and `tiles` is a view over `map`. Files written by
+    earlier versions keep their plain `tiles` table.
+    """
+
+    def __init__(self, file_name, data) -> None:
+        self.__db = sqlite3.connect(file_name)
+        self.__db.execute('CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)')
+        rec = self.__db.execute("SELECT type FROM sqlite_master WHERE name='tiles'").fetchone()
+        self.__dedup = rec is None or rec[0] == 'view'
+        if self.__dedup:
+            self.__db.execute('''CREATE TABLE IF NOT EXISTS map (
+                    zoom_level INTEGER NOT NULL,
+                    tile_column INTEGER NOT NULL,
+                    tile_row INTEGER NOT NULL,
+                    tile_id TEXT NOT NULL,
+                    PRIMARY KEY (zoom_level, tile_column, tile_row))''')
+            self.__db.execute('CREATE TABLE IF NOT EXISTS images (tile_id TEXT PRIMARY KEY, tile_data BLOB NOT NULL)')
+            # Finds the images still referenced when a tile is replaced
+            self.__db.execute('CREATE INDEX IF NOT EXISTS map_tile_id ON map (tile_id)')
+            self.__db.execute('''CREATE VIEW IF NOT EXISTS tiles AS
+                    SELECT map.zoom_level, map.tile_column, map.tile_row, images.tile_data
+                    FROM map JOIN images ON images.tile_id = map.tile_id''')
+        self.__db.executemany('INSERT OR IGNORE INTO metadata VALUES (?, ?)', [
+            ('name', data.name),
+            ('description', data.label),
+            ('type', 'baselayer'),
+            ('version', '1.0'),
+            ('format', 'png')])
+        self.__db.commit()
+
+    def set_metadata(self, name, value):
+        self.__db.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?)', (name, str(value)))
+
+    def existing_keys(self, level):
+        # tile_keys of the tiles already stored for the level, sorted
+        import numpy as np
+        rows = self.__db.execute('SELECT tile_column, tile_row FROM tiles WHERE zoom_level=?', (level,)).fetchall()
+        tiles = np.array(rows, dtype=np.int64).reshape(-1, 2)
+        return np.sort(tile_keys(level, tiles[:, 0], flip_rows(level, tiles[:, 1])))
+
+    def put(self, level, x, y, data):
+        if not self.__dedup:
+            self.__db.execute('INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)',
+                              (level, x, (1 << level) - 1 - y, sqlite3.Binary(data)))
+            return
+        tile_id = tile_hash(data).hex()
+        row = (1 << level) - 1 - y
+        old = self.__db.execute('SELECT tile_id FROM map WHERE zoom_level=? AND tile_column=? AND tile_row=?',
+                                (level, x, row)).fetchone()
+        self.__db.execute('INSERT OR IGNORE INTO images VALUES (?, ?)', (tile_id, sqlite3.Binary(data)))
+        self.__db.execute('INSERT OR REPLACE INTO map VALUES (?, ?, ?, ?)', (level, x, row, tile_id))
+        # The image of a replaced tile is deleted with its last reference
+        if old is not None and old[0] != tile_id:
+            self.__db.execute('DELETE FROM images WHERE tile_id=? AND NOT EXISTS (SELECT 1 FROM map WHERE tile_id=?)',
+                              (old[0], old[0]))
+
+    def get(self, level, x, y):
+        rec = self.__db.execute('SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?',
+                                (level, x, (1 << level) - 1 - y)).fetchone()
+        return rec[0] if rec is not None else None
+
+    def tile_ids(self, level):
+        # {(x, y): content id} of the tiles of a level; plain tables are hashed
+        n = (1 << level) - 1
+        if self.__dedup:
+            rows = self.__db.execute('SELECT tile_column, tile_row, tile_id FROM map WHERE zoom_level=?', (level,))
+            return {(x, n - row): tile_id for x, row, tile_id in rows}
+        rows = self.__db.execute('SELECT tile_column, tile_row, tile_data FROM tiles WHERE zoom_level=?', (level,))
+        return {(x, n - row): tile_hash(data).hex() for x, row, data in rows}
+
+    def overview_sources(self, level):
+        # {(x, y): signature of the children} of the tiles made by PyramidBuilder
+        self.__db.execute('''CREATE TABLE IF NOT EXISTS overviews (
+                zoom_level INTEGER NOT NULL,
+                tile_column INTEGER NOT NULL,
+                tile_row INTEGER NOT NULL,
+                sources TEXT NOT NULL,
+                PRIMARY KEY (zoom_level, tile_column, tile_row))''')
+        n = (1 << level) - 1
+        rows = self.__db.execute('SELECT tile_column, tile_row, sources FROM overviews WHERE zoom_level=?', (level,))
+        return {(x, n - row): sources for x, row, sources in rows}
+
+    def put_overview(self, level, x, y, data, sources):
+        self.put(level, x, y, data)
+        self.__db.execute('INSERT OR REPLACE INTO overviews VALUES (?, ?, ?, ?)',
+                          (level, x, (1 << level) - 1 - y, sources))
+
+    def dedup_stats(self):
+        tiles, unique = self.__db.execute('SELECT COUNT(*), COUNT(DISTINCT tile_id) FROM map').fetchone() \
+            if self.__dedup else self.__db.execute('SELECT COUNT(*), COUNT(*) FROM tiles').fetchone()
+        return tiles, unique
+
+    def commit(self):
+        self.__db.commit()
+
+    def close(self):
+        self.__db.commit()
+        self.__db.close()
+
+
+def clamp_levels(data, min_level, max_level):
+    return max(min_level, data.min_level), min(max_level, data.max_level)
+
+
+def download_tile(url, headers=None, timeout=30, service=None):
+    return scheduler().get(url, headers or {'User-Agent': USER_AGENT}, timeout, service=service)
+
+
+class TileSeeder:
+    """Downloads all tiles of a service for a bounding box and a level range into MBTiles.
+
+    Tiles already present in the output file are skipped, so an interrupted
+    run resumes where it stopped. Downloaded tiles are also put into the
+    optional TileCache.
+    """
+
+    def __init__(self, data, file_name, workers=DEFAULT_WORKERS, cache=None, transcode=None) -> None:
+        self.__data = data
+        # (format, quality) to re-encode the tiles with after the download, the catalog `transcode` by default
+        self.__transcode = transcode or transcode_settings(data)
+        self.__file_name = file_name
+        self.__workers = workers
+        self.__cache = cache
+        self.__cancelled = threading.Event()
+        self.downloaded = 0
+        self.skipped = 0
+        self.failed = 0
+        # Tiles in the output file and distinct payloads among them
+        self.stored = 0
+        self.unique = 0
+        # Sizes of the re-encoded tiles of the file before and after transcoding
+        self.original_bytes = 0
+        self.stored_bytes = 0
+        self.__format = None
+        self.__headers = service_headers(data)
+        scheduler().configure_service(data)
+        if cache is not None:
+            cache.set_live_time(data.name, data.live_time)
+
+    def cancel(self):
+        self.__cancelled.set()
+
+    def tiles(self, bbox, min_level, max_level):
+        # (level, x array, y array) chunks of the seeded tiles
+        min_level, max_level = clamp_levels(self.__data, min_level, max_level)
+        for level in range(min_level, max_level + 1):
+            for xs, ys in tile_chunks(*tile_range(bbox, level), size=CHUNK_SIZE):
+                yield level, xs, ys
+
+    def count(self, bbox, min_level, max_level):
+        min_level, max_level = clamp_levels(self.__data, min_level, max_level)
+        total = 0
+        for level in range(min_level, max_level + 1):
+            x0, y0, x1, y1 = tile_range(bbox, level)
+            total += (x1 - x0 + 1) * (y1 - y0 + 1)
+        return total
+
+    def run(self, bbox, min_level, max_level, progress=None, overviews=False):
+        # progress(done, total) is called from the calling thread. With overviews only max_level
+        # is downloaded and the lower levels are made from it by TmsPyramid.
+        import numpy as np
+        download_min = clamp_levels(self.__data, min_level, max_level)[1] if overviews else min_level
+        total = self.count(bbox, download_min, max_level)
+        out = MBTilesFile(self.__file_name, self.__data)
+        template = UrlTemplate(self.__data)
+        done = 0
+        try:
+            existing = {}
+            with ThreadPoolExecutor(max_workers=self.__workers) as pool:
+                pending = set()
+                for level, xs, ys in self.tiles(bbox, download_min, max_level):
+                    if self.__cancelled.is_set():
+                        break
+                    if level not in existing:
+                        existing[level] = out.existing_keys(level)
+                    missing = ~np.isin(tile_keys(level, xs, ys), existing[level], assume_unique=True)
+                    skipped = len(xs) - int(np.count_nonzero(missing))
+                    self.skipped += skipped
+                    done += skipped
+                    xs, ys = xs[missing], ys[missing]
+                    for x, y, url in zip(xs.tolist(), ys.tolist(), template.urls(level, xs, ys)):
+                        if self.__cancelled.is_set():
+                            break
+                        pending.add(pool.submit(self.__fetch, level, x, y, url))
+                        if len(pending) >= self.__workers * 4:
+                            done += self.__drain(pending, out, wait_all=False)
+                            if progress is not None:
+                                progress(done, total)
+                done += self.__drain(pending, out, wait_all=True)
+            if self.__format is not None:
+                out.set_metadata('format', self.__format)
+            min_level, max_level = clamp_levels(self.__data, min_level, max_level)
+            out.set_metadata('minzoom', min_level)
+            out.set_metadata('maxzoom', max_level)
+            out.set_metadata('bounds', ','.join(str(v) for v in bbox))
+            if progress is not None:
+                progress(done, total)
+        except KeyboardInterrupt:
+            self.cancel()
+            raise
+        finally:
+            out.close()
+        if overviews and not self.__cancelled.is_set():
+            from .TmsPyramid import PyramidBuilder
+            PyramidBuilder(self.__file_name, self.__data).run(max_level, min_level)
+        out = MBTilesFile(self.__file_name, self.__data)
+        self.stored, self.unique = out.dedup_stats()
+        out.close()
+        if self.__transcode is not None and not self.__cancelled.is_set():
+            try:
+                self.original_bytes, self.stored_bytes = transcode_mbtiles(self.__file_name, *self.__transcode)
+            except ImportError as error:
+                print('Tiles are not transcoded:', error, file=sys.stderr)
+        return self.downloaded, self.skipped, self.failed
+
+    def __fetch(self, level, x, y, url):
+        if self.__cancelled.is_set():
+            return level, x, y, None
+        name = self.__data.name
+        if self.__cache is not None:
+            tile = self.__cache.get(name, level, x, y)
+            if tile is not None:
+                return level, x, y, tile
+        try:
+            tile = download_tile(url, self.__headers, service=name)
+        except Exception as error:
+            print('Tile {}/{}/{}: {}'.format(level, x, y, error), file=sys.stderr)
+            return level, x, y, None
+        if self.__cache is not None:
+            self.__cache.put(name, level, x, y, tile)
+        return level, x, y, tile
+
+    def __drain(self, pending, out, wait_all):
+        done = 0
+        for future in as_completed(list(pending)):
+            pending.discard(future)
+            level, x, y, tile = future.result()
+            done += 1
+            if tile is None:
+                self.failed += 1
+            else:
+                if self.__format is None:
+                    self.__format = image_format(tile)
+                out.put(level, x, y, tile)
+                self.downloaded += 1
+            if not wait_all and len(pending) < self.__workers * 2:
+                break
+        out.commit()
+        return done
+
+
+def find_service(catalog, name):
+    for _, data in iter_services(catalog):
+        if data.name == name:
+            return data
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Download tiles of a catalog service into an MBTiles file')
+    parser.add_argument('catalog', help='ListTileServices_*.json file')
+    parser.add_argument('service', help='service name from the catalog')
+    parser.add_argument('output', help='MBTiles file to write; an existing file is resumed')
+    parser.add_argument('--bbox', required=True, type=float, nargs=4,
+                        metavar=('MIN_LON', 'MIN_LAT', 'MAX_LON', 'MAX_LAT'))
+    parser.add_argument('--min-level', type=int, default=0)
+    parser.add_argument('--max-level', type=int, default=19)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--format', choices=FORMATS, help='re-encode the tiles (requires Pillow); '
+                        'the `transcode` of the service is used by default')
+    parser.add_argument('--quality', type=int, default=80)
+    parser.add_argument('--overviews', action='store_true',
+                        help='download only the max level and make the lower levels from it')
+    args = parser.parse_args(argv)
+
+    with open(args.catalog, 'r', encoding='UTF-8') as f:
+        catalog = json.load(f)
+    data = find_service(catalog, args.service)
+    if data is None:
+        parser.error("service '{}' is not found".format(args.service))
+    if data.type_service != 'tms':
+        parser.error("service '{}' is a composite service".format(args.service))
+
+    seeder = TileSeeder(data, args.output, args.workers,
+                        transcode=(args.format, args.quality) if args.format else None)
+
+    def progress(done, total):
+        print('\r{}/{}'.format(done, total), end='', file=sys.stderr)
+
+    try:
+        downloaded, skipped, failed = seeder.run(args.bbox, args.min_level, args.max_level, progress, args.overviews)
+    except KeyboardInterrupt:
+        seeder.cancel()
+        print('\nInterrupted, run again to resume', file=sys.stderr)
+        return 1
+    print('\nDownloaded: {}, skipped: {}, failed: {}'.format(downloaded, skipped, failed), file=sys.stderr)
+    if seeder.unique:
+        print('Tiles: {}, distinct: {}, dedup ratio: {:.2f}'.format(seeder.stored, seeder.unique,
+              seeder.stored / seeder.unique), file=sys.stderr)
+    if seeder.original_bytes:
+        print('Transcoded: {} bytes, originally {} bytes'.format(seeder.stored_bytes, seeder.original_bytes),
+              file=sys.stderr)
+    return 0 if failed == 0 else 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import http.server
+import re
+import sys
+import threading
+import time
+from urllib.parse import quote, unquote
+
+from .TmsImage import image_format
+from .TmsMetrics import metrics
+
+
+PATH_RE = re.compile(r'^/([^/]+)/(\d+)/(\d+)/(\d+)\.\w+$')
+CONTENT_TYPES = {'png': 'image/png', 'jpg': 'image/jpeg', 'webp': 'image/webp'}
+
+
+class TileServer:
+    """HTTP server on the loopback interface serving tiles produced by the plugin.
+
+    Sources are objects with a `tile(level, x, y)` method returning the
+    encoded tile; the host application opens them as ordinary xyz services
+    with `url_template(name)`.
+    """
+
+    def __init__(self, port=0) -> None:
+        self.__sources = {}
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.__httpd = http.server.ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.__httpd.daemon_threads = True
+        self.__thread = threading.Thread(target=self.__httpd.serve_forever, name='TmsServer', daemon=True)
+        self.__thread.start()
+
+    @property
+    def port(self):
+        return self.__httpd.server_address[1]
+
+    def register(self, source):
+        self.unregister(source.name)
+        self.__sources[source.name] = source
+
+    def unregister(self, name):
+        source = self.__sources.pop(name, None)
+        if source is not None:
+            source.close()
+
+    def url_template(self, name):
+        return 'http://127.0.0.1:{}/{}/{{LEVEL}}/{{ROW}}/{{COL}}.png'.format(self.port, quote(name, safe=''))
+
+    def handle(self, request):
+        m = PATH_RE.match(request.path)
+        source = self.__sources.get(unquote(m.group(1))) if m is not None else None
+        if source is None:
+            request.send_error(404)
+            return
+        level, x, y = int(m.group(2)), int(m.group(3)), int(m.group(4))
+        start = time.perf_counter()
+        try:
+            tile = source.tile(level, x, y)
+        except Exception as error:
+            metrics().inc('tms_served_errors_total', service=source.name)
+            print('Tile {} {}/{}/{}: {}'.format(source.name, level, x, y, error), file=sys.stderr)
+            request.send_error(502)
+            return
+        metrics().observe('tms_served_seconds', time.perf_counter() - start, service=source.name)
+        request.send_response(200)
+        request.send_header('Content-Type', CONTENT_TYPES[image_format(tile)])
+        request.send_header('Content-Length', str(len(tile)))
+        request.end_headers()
+        request.wfile.write(tile)
+
+    def stop(self):
+        self.__httpd.shutdown()
+        self.__httpd.server_close()
+        for name in list(self.__sources):
+            self.unregister(name)
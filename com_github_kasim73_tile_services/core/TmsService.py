@@ -0,0 +1,177 @@
+import sys
+
+
+DEFAULT_MIN_LEVEL = 0
+DEFAULT_MAX_LEVEL = 19
+# The highest level the tile keys of TmsUrl can hold
+MAX_LEVEL = 29
+DEFAULT_TILE_SIZE = (256, 256)
+TYPE_ADDRESSES = ('xyz', 'quadkey')
+
+
+class CatalogError(ValueError):
+    pass
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _optional_text(name, key, value):
+    if value is not None and not isinstance(value, str):
+        raise CatalogError("Service '{}': '{}' must be a string".format(name, key))
+    return value
+
+
+class Service:
+    """A catalog service, validated once when the catalog is loaded.
+
+    Services are shared by reference between the tree, the tile sources and
+    the tools, and are not changed after they are made; `replace` returns a
+    changed copy. Strings repeated across services (names, coordinate
+    systems, address types, images, headers) are interned.
+    """
+
+    __slots__ = ('name', 'type_service', 'url', 'type_address', 'members', 'title', 'description', 'image',
+                 'size', 'min_level', 'max_level', 'prj', 'live_time', 'header', 'transcode', 'connections', 'rate')
+
+    def __init__(self, name, url=None, type_address='xyz', members=None, title=None, description=None, image=None,
+                 size=DEFAULT_TILE_SIZE, min_level=DEFAULT_MIN_LEVEL, max_level=DEFAULT_MAX_LEVEL, prj=None,
+                 live_time=0, header=None, transcode=None, connections=None, rate=None) -> None:
+        if not isinstance(name, str) or not name:
+            raise CatalogError('Service name must be a non-empty string, not {!r}'.format(name))
+        self.name = sys.intern(name)
+        if members:
+            # Member services by name, bottom to top
+            self.members = tuple((sys.intern(m), float(opacity)) for m, opacity in members)
+            if not all(0.0 <= opacity <= 1.0 for _, opacity in self.members):
+                raise CatalogError("Service '{}': member opacity must be between 0 and 1".format(name))
+            self.type_service = 'composite'
+            self.url = None
+            self.type_address = None
+        else:
+            if not isinstance(url, str) or not url:
+                raise CatalogError("Service '{}': 'url' is missing".format(name))
+            if type_address not in TYPE_ADDRESSES:
+                raise CatalogError("Service '{}': unknown address type '{}', expected one of {}".format(
+                    name, type_address, ', '.join(TYPE_ADDRESSES)))
+            self.members = None
+            self.type_service = 'tms'
+            self.url = url
+            self.type_address = sys.intern(type_address)
+        self.title = _optional_text(name, 'title', title)
+        self.description = _optional_text(name, 'description', description)
+        self.image = sys.intern(_optional_text(name, 'image', image)) if image is not None else None
+        if len(size) != 2 or not all(isinstance(v, int) and v > 0 for v in size):
+            raise CatalogError("Service '{}': tile size must be two positive integers".format(name))
+        self.size = tuple(size)
+        if not (isinstance(min_level, int) and isinstance(max_level, int) and 0 <= min_level <= max_level <= MAX_LEVEL):
+            raise CatalogError("Service '{}': invalid levels {}..{}, expected integers 0 <= min <= max <= {}".format(
+                name, min_level, max_level, MAX_LEVEL))
+        self.min_level = min_level
+        self.max_level = max_level
+        self.prj = sys.intern(_optional_text(name, 'cs', prj)) if prj is not None else None
+        if not _is_number(live_time) or live_time < 0:
+            raise CatalogError("Service '{}': 'liveTime' must be a non-negative number".format(name))
+        self.live_time = live_time
+        if header is not None:
+            if not isinstance(header, dict) or not all(isinstance(k, str) and isinstance(v, str) for k, v in header.items()):
+                raise CatalogError("Service '{}': 'header' must map names to strings".format(name))
+            header = {sys.intern(k): sys.intern(v) for k, v in header.items()}
+        self.header = header or None
+        if transcode is not None:
+            fmt, quality = transcode
+            if not isinstance(fmt, str) or not isinstance(quality, int) or not 1 <= quality <= 100:
+                raise CatalogError("Service '{}': 'transcode' needs a format and a quality within 1..100".format(name))
+            transcode = (sys.intern(fmt), quality)
+        self.transcode = transcode
+        if connections is not None and (not isinstance(connections, int) or connections < 1):
+            raise CatalogError("Service '{}': 'connections' must be a positive integer".format(name))
+        self.connections = connections
+        if rate is not None and (not _is_number(rate) or rate <= 0):
+            raise CatalogError("Service '{}': 'rate' must be a positive number".format(name))
+        self.rate = rate
+
+    @classmethod
+    def from_json(cls, tms):
+        # Service of a catalog json entry
+        name = tms.get('name') if isinstance(tms, dict) else None
+        try:
+            level = tms.get('level', {})
+            size = tms.get('size')
+            limits = tms.get('limits', {})
+            transcode = tms.get('transcode')
+            if 'composite' in tms:
+                members = [(m['name'], m.get('opacity', 1.0)) for m in tms['composite']]
+                if not members:
+                    raise CatalogError("Service '{}': 'composite' has no members".format(name))
+            else:
+                members = None
+            return cls(name,
+                       url=tms.get('url'),
+                       type_address=tms.get('type', 'xyz'),
+                       members=members,
+                       title=tms.get('title'),
+                       description=tms.get('description'),
+                       image=tms.get('image'),
+                       size=(size['width'], size['height']) if size is not None else DEFAULT_TILE_SIZE,
+                       min_level=level.get('min', DEFAULT_MIN_LEVEL),
+                       max_level=level.get('max', DEFAULT_MAX_LEVEL),
+                       prj=tms.get('cs'),
+                       live_time=tms.get('liveTime', 0),
+                       header=tms.get('header'),
+                       transcode=(transcode['format'], transcode.get('quality', 80)) if transcode is not None else None,
+                       connections=limits.get('connections'),
+                       rate=limits.get('rate'))
+        except (KeyError, TypeError, AttributeError, ValueError) as error:
+            if isinstance(error, CatalogError):
+                raise
+            raise CatalogError("Service '{}': malformed entry ({}: {})".format(name, error.__class__.__name__, error))
+
+    @classmethod
+    def from_tuple(cls, values):
+        # Service of a to_tuple result; the values were validated when it was made and marshal keeps
+        # the strings interned
+        service = cls.__new__(cls)
+        (service.name, service.type_service, service.url, service.type_address, service.members, service.title,
+         service.description, service.image, service.size, service.min_level, service.max_level, service.prj,
+         service.live_time, service.header, service.transcode, service.connections, service.rate) = values
+        return service
+
+    def to_tuple(self):
+        # Plain values in the __slots__ order, for the catalog snapshots
+        return (self.name, self.type_service, self.url, self.type_address, self.members, self.title,
+                self.description, self.image, self.size, self.min_level, self.max_level, self.prj,
+                self.live_time, self.header, self.transcode, self.connections, self.rate)
+
+    def replace(self, **changes):
+        values = {key: getattr(self, key) for key in self.__slots__ if key != 'type_service'}
+        values.update(changes)
+        return Service(**values)
+
+    @property
+    def label(self):
+        return self.title or self.name
+
+    def open_arguments(self):
+        # Keyword arguments of provider_manager.tms.open
+        return {
+            'templateUrl': self.url,
+            'type_address': self.type_address,
+            'minLevel': self.min_level,
+            'maxLevel': self.max_level,
+            'size': self.size,
+            'prj': self.prj,
+            'live_time': self.live_time,
+            'alias': self.title
+        }
+
+    def __eq__(self, other):
+        if not isinstance(other, Service):
+            return NotImplemented
+        return self.to_tuple() == other.to_tuple()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Service({!r})'.format(self.name)
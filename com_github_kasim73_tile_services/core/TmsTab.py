@@ -0,0 +1,54 @@
+import os
+import re
+from pathlib import Path
+from xml.sax.saxutils import escape, quoteattr
+
+
+DEFAULT_PRJ = 'CoordSys Earth Projection 10, 157, "m", 0 Bounds (-20037508.34, -20037508.34) (20037508.34, 20037508.34)'
+
+TAB_TEMPLATE = """!table
+!version 1050
+!charset WindowsCyrillic
+
+Definition Table
+  File "{xml}"
+  Type "TILESERVER"
+ {prj}
+ReadOnly
+"""
+
+XML_TEMPLATE = """<?xml version="1.0" ?>
+<TileServerInfo Type={type}>
+\t<Url>{url}</Url>
+\t<MinLevel>{min}</MinLevel>
+\t<MaxLevel>{max}</MaxLevel>
+\t<TileSize Height={height} Width={width}/>
+</TileServerInfo>
+"""
+
+
+def mapinfo_url(url):
+    # MapInfo does not know mirror groups, every '[0123]' group is replaced by its first host
+    return re.sub(r'\[(\w)\w*\]', r'\1', url)
+
+
+def generate_tile_tab_file(fn, data):
+    path = Path(fn)
+    xml_fn = '{}.xml'.format(path.stem)
+    with open(fn.encode('utf-8'), 'w', encoding='cp1251') as tab:
+        tab.write(TAB_TEMPLATE.format(xml=xml_fn, prj=data.prj or DEFAULT_PRJ))
+    width, height = data.size
+    content = XML_TEMPLATE.format(
+        type=quoteattr('QuadKey' if data.type_address == 'quadkey' else 'LevelRowColumn'),
+        url=escape(mapinfo_url(data.url)),
+        min=data.min_level,
+        max=data.max_level,
+        height=quoteattr(str(height)),
+        width=quoteattr(str(width)))
+    with open(os.path.join(path.parent, xml_fn).encode('utf-8'), 'w', encoding='cp1251') as fxml:
+        fxml.write(content)
+
+
+def tab_filename(category, data):
+    name = '{}_{}.tab'.format(data.name, category).lower()
+    return re.sub(r'[<>:"/\\|?*]', '_', name)
@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from importlib.util import find_spec
+
+from .TmsCatalog import iter_services
+from .TmsImage import image_format
+from .TmsMetrics import metrics
+
+
+FORMATS = ('jpeg', 'webp', 'png8', 'png')
+DEFAULT_QUALITY = 80
+DEFAULT_WORKERS = None
+BATCH_SIZE = 64
+
+
+def transcode(data, fmt, quality=DEFAULT_QUALITY):
+    # Re-encoded tile, or None when the tile is better kept as is: it is not smaller
+    # or it has transparency that JPEG can not hold
+    import io
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+        if has_alpha and image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        if fmt == 'jpeg':
+            if has_alpha and image.getextrema()[3][0] < 255:
+                return None
+            image = image.convert('RGB')
+            options = {'format': 'JPEG', 'quality': quality, 'optimize': True}
+        elif fmt == 'webp':
+            options = {'format': 'WEBP', 'quality': quality, 'method': 4}
+        elif fmt == 'png8':
+            image = image.quantize(256, method=Image.FASTOCTREE if has_alpha else Image.MEDIANCUT)
+            options = {'format': 'PNG', 'optimize': True}
+        else:
+            options = {'format': 'PNG', 'optimize': True}
+        out = io.BytesIO()
+        image.save(out, **options)
+    result = out.getvalue()
+    return result if len(result) < len(data) else None
+
+
+def transcode_batch(items, fmt, quality):
+    # Runs in a worker process: [(key, data)] -> [(key, new data or None)]
+    result = []
+    for key, data in items:
+        try:
+            result.append((key, transcode(data, fmt, quality)))
+        except Exception:
+            result.append((key, None))
+    return result
+
+
+def transcode_settings(data):
+    # (format, quality) of the catalog `transcode` of a service, None when it is not set
+    settings = data.transcode
+    if settings is None:
+        return None
+    fmt, quality = settings
+    if fmt not in FORMATS:
+        raise ValueError("Unknown transcode format '{}'".format(fmt))
+    return fmt, quality
+
+
+class Transcoder:
+    """Re-encodes batches of tiles in a pool of worker processes.
+
+    Imaging libraries hold the GIL while encoding, so processes rather than
+    threads are used. Requires Pillow.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS) -> None:
+        self.__workers = workers or os.cpu_count() or 1
+        self.__pool = None
+        self.original_bytes = 0
+        self.stored_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def run(self, items, fmt, quality, service=None):
+        # items are (key, data) pairs; yields lists of (key, data to store, original size)
+        # Fail early in the calling process
+        if find_spec('PIL') is None:
+            raise ImportError("No module named 'PIL'", name='PIL')
+        if self.__pool is None:
+            self.__pool = ProcessPoolExecutor(max_workers=self.__workers)
+        pending = deque()
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= BATCH_SIZE:
+                pending.append((self.__pool.submit(transcode_batch, batch, fmt, quality), batch))
+                batch = []
+                # A few batches per process in flight keep the memory bounded
+                if len(pending) > 2 * self.__workers:
+                    yield self.__result(*pending.popleft(), service)
+        if batch:
+            pending.append((self.__pool.submit(transcode_batch, batch, fmt, quality), batch))
+        while pending:
+            yield self.__result(*pending.popleft(), service)
+
+    def __result(self, future, batch, service):
+        registry = metrics()
+        label = service or ''
+        result = []
+        for (key, original), (_, data) in zip(batch, future.result()):
+            stored = data if data is not None else original
+            self.original_bytes += len(original)
+            self.stored_bytes += len(stored)
+            registry.inc('tms_transcode_original_bytes_total', len(original), service=label)
+            registry.inc('tms_transcode_stored_bytes_total', len(stored), service=label)
+            result.append((key, stored, len(original)))
+        return result
+
+    def close(self):
+        if self.__pool is not None:
+            self.__pool.shutdown()
+            self.__pool = None
+
+
+def transcode_mbtiles(file_name, fmt, quality=DEFAULT_QUALITY, transcoder=None, progress=None):
+    # Re-encodes the tiles of an MBTiles file once per format; returns (original bytes, stored bytes) of all
+    # transcoded tiles of the file. Tiles transcoded to another format before are transcoded again.
+    db = sqlite3.connect(file_name)
+    try:
+        db.execute('''CREATE TABLE IF NOT EXISTS transcoded (
+            tile_id TEXT PRIMARY KEY, original_size INTEGER, size INTEGER, format TEXT, encoding TEXT)''')
+        columns = [r[1] for r in db.execute('PRAGMA table_info(transcoded)')]
+        if 'format' not in columns:
+            # Files of older versions did not record the formats, their tiles are transcoded again
+            db.execute('ALTER TABLE transcoded ADD COLUMN format TEXT')
+            db.execute('ALTER TABLE transcoded ADD COLUMN encoding TEXT')
+        dedup = db.execute("SELECT type FROM sqlite_master WHERE name='tiles'").fetchone()[0] == 'view'
+        if dedup:
+            ids = 'SELECT tile_id FROM images'
+            read = 'SELECT tile_data FROM images WHERE tile_id=?'
+            update = 'UPDATE images SET tile_data=? WHERE tile_id=?'
+        else:
+            # The tile id of a plain tiles table is its position
+            position = "zoom_level || '/' || tile_column || '/' || tile_row"
+            ids = 'SELECT {} FROM tiles'.format(position)
+            read = 'SELECT tile_data FROM tiles WHERE {}=?'.format(position)
+            update = 'UPDATE tiles SET tile_data=? WHERE {}=?'.format(position)
+        select = '{} EXCEPT SELECT tile_id FROM transcoded WHERE format=?'.format(ids)
+        keys = [r[0] for r in db.execute(select, (fmt,))]
+        total = len(keys)
+
+        def items():
+            # Tiles are read one by one, the file is updated while they are transcoded
+            for key in keys:
+                yield key, db.execute(read, (key,)).fetchone()[0]
+
+        own = transcoder is None
+        transcoder = transcoder or Transcoder()
+        done = 0
+        try:
+            for batch in transcoder.run(items(), fmt, quality):
+                db.executemany(update, [(sqlite3.Binary(data), key) for key, data, _ in batch])
+                db.executemany('INSERT OR REPLACE INTO transcoded VALUES (?, ?, ?, ?, ?)',
+                               [(key, original, len(data), fmt, image_format(data)) for key, data, original in batch])
+                db.commit()
+                done += len(batch)
+                if progress is not None:
+                    progress(done, total)
+        finally:
+            if own:
+                transcoder.close()
+        # Tiles that are not smaller in the new format keep their encoding. The format of a file with
+        # mixed encodings stays as it is while some tiles have it, otherwise it is the most common one.
+        encodings = dict(db.execute('SELECT encoding, COUNT(*) FROM transcoded WHERE tile_id IN ({}) '
+                                    'GROUP BY encoding'.format(ids)).fetchall())
+        if encodings and None not in encodings:
+            current = db.execute("SELECT value FROM metadata WHERE name='format'").fetchone()
+            if len(encodings) > 1:
+                print('{}: tiles are encoded as {}'.format(file_name, ', '.join(sorted(encodings))), file=sys.stderr)
+            if len(encodings) == 1 or current is None or current[0] not in encodings:
+                db.execute("INSERT OR REPLACE INTO metadata VALUES ('format', ?)",
+                           (max(encodings, key=encodings.get),))
+                db.commit()
+        return db.execute('SELECT COALESCE(SUM(original_size), 0), COALESCE(SUM(size), 0) FROM transcoded').fetchone()
+    finally:
+        db.close()
+
+
+def transcode_cache(cache, services, transcoder=None, progress=None):
+    # Re-encodes cached tiles of the services that have `transcode` settings
+    own = transcoder is None
+    transcoder = transcoder or Transcoder()
+    try:
+        for data in services:
+            settings = transcode_settings(data)
+            if settings is None:
+                continue
+            for batch in transcoder.run(cache.untranscoded(data.name), *settings, service=data.name):
+                cache.replace_blobs(batch)
+                if progress is not None:
+                    progress(data.name, len(batch))
+    finally:
+        if own:
+            transcoder.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Re-encode tiles of MBTiles files or of the plugin tile cache')
+    parser.add_argument('files', nargs='+', help='MBTiles files written by TmsSeed, or the TileCache.mbtiles file with --catalog')
+    parser.add_argument('--format', choices=FORMATS, help='format of MBTiles files')
+    parser.add_argument('--quality', type=int, default=DEFAULT_QUALITY)
+    parser.add_argument('--catalog', help='transcode the tile cache by the `transcode` settings of this catalog')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    args = parser.parse_args(argv)
+    if (args.format is None) == (args.catalog is None):
+        parser.error('either --format or --catalog is required')
+
+    def progress(done, total):
+        print('\r{}/{}'.format(done, total), end='', file=sys.stderr)
+
+    with Transcoder(args.workers) as transcoder:
+        if args.catalog is not None:
+            from .TmsCache import TileCache
+            with open(args.catalog, 'r', encoding='UTF-8') as f:
+                services = [data for _, data in iter_services(json.load(f))]
+            for fn in args.files:
+                cache = TileCache(fn)
+                try:
+                    transcode_cache(cache, services, transcoder)
+                finally:
+                    cache.close()
+        else:
+            for fn in args.files:
+                print(fn, file=sys.stderr)
+                transcode_mbtiles(fn, args.format, args.quality, transcoder, progress)
+                print(file=sys.stderr)
+    if transcoder.original_bytes:
+        print('Original: {} bytes, stored: {} bytes ({:.0%})'.format(
+            transcoder.original_bytes, transcoder.stored_bytes,
+            transcoder.stored_bytes / transcoder.original_bytes), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
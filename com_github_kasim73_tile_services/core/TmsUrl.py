@@ -0,0 +1,160 @@
+import math
+import re
+from itertools import repeat
+
+
+MAX_LATITUDE = 85.0511287798
+# Half of the EPSG:3857 world width in meters
+MERCATOR_EXTENT = 20037508.342789244
+FIELD_RE = re.compile(r'(\{LEVEL\}|\{ROW\}|\{COL\}|\{QUADKEY\}|\[\w+\])')
+# Positional arguments of the compiled format string, the mirror groups follow them
+FIELDS = {'{LEVEL}': 0, '{ROW}': 1, '{COL}': 2, '{QUADKEY}': 3}
+# Bits of x and y in a packed tile key, enough for level 29
+KEY_BITS = 29
+
+
+def mirror_groups(url):
+    # '[0123]' groups list the mirror hosts of the service
+    return re.findall(r'\[(\w+)\]', url)
+
+
+def mirrors(url):
+    # Mirror i takes letter i of every group, the shorter groups are cycled
+    groups = mirror_groups(url)
+    if not groups:
+        return ['']
+    return [''.join(group[i % len(group)] for group in groups) for i in range(max(map(len, groups)))]
+
+
+def quadkey(level, x, y):
+    digits = []
+    for i in range(level, 0, -1):
+        mask = 1 << (i - 1)
+        digits.append(chr(48 + ((x & mask) != 0) + 2 * ((y & mask) != 0)))
+    return ''.join(digits)
+
+
+def lonlat_to_tile(lon, lat, level):
+    n = 1 << level
+    lat = max(min(lat, MAX_LATITUDE), -MAX_LATITUDE)
+    x = int((lon + 180.0) / 360.0 * n)
+    r = math.radians(lat)
+    y = int((1.0 - math.log(math.tan(r) + 1.0 / math.cos(r)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_range(bbox, level):
+    # bbox is (min lon, min lat, max lon, max lat); returns inclusive x0, y0, x1, y1
+    x0, y0 = lonlat_to_tile(bbox[0], bbox[3], level)
+    x1, y1 = lonlat_to_tile(bbox[2], bbox[1], level)
+    return x0, y0, x1, y1
+
+
+def lonlat_to_tiles(lons, lats, level):
+    import numpy as np
+    n = 1 << level
+    lats = np.radians(np.clip(np.asarray(lats, dtype=np.float64), -MAX_LATITUDE, MAX_LATITUDE))
+    xs = ((np.asarray(lons, dtype=np.float64) + 180.0) / 360.0 * n).astype(np.int64)
+    ys = ((1.0 - np.log(np.tan(lats) + 1.0 / np.cos(lats)) / np.pi) / 2.0 * n).astype(np.int64)
+    return np.clip(xs, 0, n - 1), np.clip(ys, 0, n - 1)
+
+
+def tile_grid(x0, y0, x1, y1):
+    # x and y arrays of all tiles of the inclusive range, column by column
+    import numpy as np
+    xs = np.arange(x0, x1 + 1, dtype=np.int64)
+    ys = np.arange(y0, y1 + 1, dtype=np.int64)
+    return np.repeat(xs, len(ys)), np.tile(ys, len(xs))
+
+
+def tile_chunks(x0, y0, x1, y1, size=65536):
+    # tile_grid split into chunks of about size tiles, so huge ranges are never materialized at once
+    columns = max(1, size // (y1 - y0 + 1))
+    for cx in range(x0, x1 + 1, columns):
+        yield tile_grid(cx, y0, min(cx + columns - 1, x1), y1)
+
+
+def flip_rows(level, ys):
+    # XYZ <-> TMS row numbering
+    return ((1 << level) - 1) - ys
+
+
+def tile_keys(level, xs, ys):
+    # Packs (level, x, y) into int64 keys usable with numpy set operations
+    import numpy as np
+    return (np.int64(level) << (2 * KEY_BITS)) | (np.asarray(xs, dtype=np.int64) << KEY_BITS) | np.asarray(ys, dtype=np.int64)
+
+
+def quadkeys(level, xs, ys):
+    import numpy as np
+    xs = np.asarray(xs, dtype=np.int64)
+    if level == 0:
+        return [''] * len(xs)
+    shifts = np.arange(level - 1, -1, -1, dtype=np.int64)
+    digits = ((xs[:, None] >> shifts) & 1) + 2 * ((np.asarray(ys, dtype=np.int64)[:, None] >> shifts) & 1)
+    chars = np.ascontiguousarray((digits + 48).astype(np.uint8))
+    return chars.view('S{}'.format(level)).ravel().astype('U{}'.format(level)).tolist()
+
+
+class UrlTemplate:
+    """Catalog URL template compiled once into a str.format call.
+
+    Mirror hosts of the '[0123]' groups are chosen round-robin by (x + y), so
+    a tile always maps to the same host and neighbouring tiles are spread
+    over all of them. `urls` joins whole columns of url parts instead of
+    formatting every url.
+    """
+
+    def __init__(self, data) -> None:
+        url = data.url
+        self.mirrors = mirrors(url)
+        self.__mirror_index = {mirror: i for i, mirror in enumerate(self.mirrors)}
+        self.__groups = mirror_groups(url)
+        self.is_quadkey = data.type_address == 'quadkey'
+        # (field, text) of the url parts; field is a FIELDS position, a mirror group or None for text
+        self.__parts = []
+        parts = []
+        group = len(FIELDS)
+        for part in FIELD_RE.split(url):
+            if part in FIELDS:
+                self.__parts.append((FIELDS[part], None))
+                parts.append('{{{}}}'.format(FIELDS[part]))
+            elif FIELD_RE.fullmatch(part):
+                self.__parts.append((group, None))
+                parts.append('{{{}}}'.format(group))
+                group += 1
+            elif part:
+                self.__parts.append((None, part))
+                parts.append(part.replace('{', '{{').replace('}', '}}'))
+        self.__format = ''.join(parts).format
+
+    def url(self, level, x, y, mirror=None):
+        index = (x + y) % len(self.mirrors) if mirror is None else self.__mirror_index[mirror]
+        return self.__format(level, x, y, quadkey(level, x, y) if self.is_quadkey else '',
+                             *(group[index % len(group)] for group in self.__groups))
+
+    def urls(self, level, xs, ys):
+        # The same urls as `url` for arrays of x and y
+        import numpy as np
+        xs = np.asarray(xs, dtype=np.int64)
+        ys = np.asarray(ys, dtype=np.int64)
+        count = len(xs)
+        index = (xs + ys) % len(self.mirrors)
+        columns = []
+        for field, text in self.__parts:
+            if field is None:
+                columns.append(repeat(text, count))
+            elif field == 0:
+                columns.append(repeat(str(level), count))
+            elif field == 1:
+                columns.append(map(str, xs.tolist()))
+            elif field == 2:
+                columns.append(map(str, ys.tolist()))
+            elif field == 3:
+                columns.append(quadkeys(level, xs, ys) if self.is_quadkey else repeat('', count))
+            else:
+                group = self.__groups[field - len(FIELDS)]
+                columns.append(np.array(list(group))[index % len(group)].tolist())
+        if not columns:
+            return [''] * count
+        return list(map(''.join, zip(*columns)))
@@ -0,0 +1,96 @@
+import os
+import hashlib
+import json
+import tempfile
+from pathlib import Path
+
+
+class DownloadCancelled(Exception):
+    pass
+
+
+def download_catalog(url, validators=None, timeout=30, progress=None, cancelled=None, retries=None):
+    # Returns (data, validators); data is None when the server answers 304 Not Modified.
+    # `cancelled` is a threading.Event that stops the download.
+    import gzip
+    from .TmsHttp import scheduler, HttpError, USER_AGENT
+    headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip'}
+    if validators:
+        if 'etag' in validators:
+            headers['If-None-Match'] = validators['etag']
+        if 'last_modified' in validators:
+            headers['If-Modified-Since'] = validators['last_modified']
+    response = scheduler().request(url, headers, timeout, retries, progress, cancelled)
+    if response.status == 304:
+        return None, validators
+    if not 200 <= response.status < 300:
+        raise HttpError(url, response.status)
+    data = response.body
+    if response.headers.get('content-encoding', '').lower() == 'gzip':
+        data = gzip.decompress(data)
+    new_validators = {}
+    if response.headers.get('etag'):
+        new_validators['etag'] = response.headers['etag']
+    if response.headers.get('last-modified'):
+        new_validators['last_modified'] = response.headers['last-modified']
+    return data, new_validators
+
+
+def replace_file(file_name, data):
+    # The new content is written next to the file and then atomically renamed over it
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(file_name) or None, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_name, 0o644)
+        os.replace(tmp_name, file_name)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+
+
+def load_validators(file_name):
+    # HTTP validators (ETag, Last-Modified) of the downloaded catalog are kept next to it
+    meta = file_name + '.meta'
+    if not os.path.isfile(file_name) or not os.path.isfile(meta):
+        return None
+    try:
+        with open(meta, 'r', encoding='UTF-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_validators(file_name, validators):
+    replace_file(file_name + '.meta', json.dumps(validators).encode('utf-8'))
+
+
+def json_filename(language):
+    return f'ListTileServices_{language}.json'
+
+def doc_index_filename(language):
+    return f'index_{language}.html'
+
+def cache_filename():
+    return 'TileCache.mbtiles'
+
+def snapshot_filename(json_file):
+    # the bundled and the downloaded catalogs share the name, so the path is a part of the key
+    key = hashlib.sha1(os.path.abspath(json_file).encode('utf-8')).hexdigest()[:8]
+    return '{}_{}.snapshot'.format(Path(json_file).stem, key)
+
+def probe_filename():
+    return 'ProbeReport.json'
+
+def metrics_filename():
+    return 'Metrics.json'
+
+def metrics_prometheus_filename():
+    return 'Metrics.prom'
+
+def gateway_filename():
+    return 'Gateway.json'
+
+def catalogs_dirname():
+    return 'catalogs'
@@ -0,0 +1,3 @@
+# Qt-free part of the plugin: catalog model, tile URLs, TAB files, tile cache, seeding and probing.
+# Modules of this package must not import PySide2 or axipy, so that they can be used in headless scripts:
+#   python -m com_github_kasim73_tile_services.core.TmsSeed ...
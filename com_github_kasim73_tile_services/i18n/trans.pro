@@ -1,6 +1,7 @@
 # lrelease translation_en.ts
 
-SOURCES         = ../__init__.py \
+SOURCES         = ../TmsPlugin.py \
                   ../TmsWidget.py \
-                  ../TmsTreeWidget.py
+                  ../TmsTreeWidget.py \
+                  ../TmsDiagnostics.py
 TRANSLATIONS    = translation_en.ts
@@ -4,22 +4,22 @@
 <context>
     <name>com_github_kasim73_tile_services</name>
     <message>
-        <location filename="../__init__.py" line="51"/>
+        <location filename="../TmsPlugin.py" line="51"/>
         <source>Карты из Интернета</source>
         <translation>Internet maps</translation>
     </message>
     <message>
-        <location filename="../__init__.py" line="25"/>
+        <location filename="../TmsPlugin.py" line="25"/>
         <source>Добавление слоя из каталога Интернет-карт</source>
         <translation>Add layer from Internet-maps</translation>
     </message>
     <message>
-        <location filename="../__init__.py" line="32"/>
+        <location filename="../TmsPlugin.py" line="32"/>
         <source>Основные</source>
         <translation>Main</translation>
     </message>
     <message>
-        <location filename="../__init__.py" line="32"/>
+        <location filename="../TmsPlugin.py" line="32"/>
         <source>Команды</source>
         <translation>Commands</translation>
     </message>
@@ -99,5 +99,160 @@
         <source>Список обновлен</source>
         <translation>List has been updated</translation>
     </message>
+    <message>
+        <location filename="../TmsWidget.py" line="187"/>
+        <source>Загрузка списка сервисов...</source>
+        <translation>Downloading the service list...</translation>
+    </message>
+    <message>
+        <location filename="../TmsWidget.py" line="187"/>
+        <source>Отмена</source>
+        <translation>Cancel</translation>
+    </message>
+    <message>
+        <location filename="../TmsWidget.py" line="228"/>
+        <source>Список сервисов не изменился</source>
+        <translation>Service list has not changed</translation>
+    </message>
+    <message>
+        <location filename="../TmsWidget.py" line="106"/>
+        <source>Проверить сервисы</source>
+        <translation>Check services</translation>
+    </message>
+    <message>
+        <location filename="../TmsWidget.py" line="108"/>
+        <source>Проверить доступность и скорость ответа сервисов</source>
+        <translation>Check availability and response time of the services</translation>
+    </message>
+    <message>
+        <location filename="../TmsWidget.py" line="153"/>
+        <source>Сохранить отчет о проверке...</source>
+        <translation>Save check report...</translation>
+    </message>
+    <message>
+        <location filename="../TmsTreeWidget.py" line="154"/>
+        <source>{}: {:.0f} мс (соединение {:.0f}, первый байт {:.0f}, передача {:.0f}), {} байт</source>
+        <translation>{}: {:.0f} ms (connect {:.0f}, first byte {:.0f}, transfer {:.0f}), {} bytes</translation>
+    </message>
+    <message>
+        <location filename="../TmsWidget.py" line="124"/>
+        <source>Поиск</source>
+        <translation>Search</translation>
+    </message>
+    <message>
+        <location filename="../TmsWidget.py" line="173"/>
+        <source>Сохранить категорию в папку...</source>
+        <translation>Save category to folder...</translation>
+    </message>
+    <message>
+        <location filename="../TmsWidget.py" line="176"/>
+        <source>Сохранить весь каталог в папку...</source>
+        <translation>Save whole catalog to folder...</translation>
+    </message>
+    <message>
+        <location filename="../TmsWidget.py" line="290"/>
+        <source>Выбор папки</source>
+        <translation>Select folder</translation>
+    </message>
+    <message>
+        <location filename="../TmsWidget.py" line="294"/>
+        <source>Сохранение TAB-файлов...</source>
+        <translation>Saving TAB files...</translation>
+    </message>
+    <message>
+        <location filename="../TmsWidget.py" line="310"/>
+        <source>Сохранено файлов: {}</source>
+        <translation>Files saved: {}</translation>
+    </message>
+    <message>
+        <location filename="../TmsWidget.py" line="129"/>
+        <source>Диагностика</source>
+        <translation>Diagnostics</translation>
+    </message>
+    <message>
+        <location filename="../TmsWidget.py" line="131"/>
+        <source>Время операций и статистика запросов к сервисам</source>
+        <translation>Operation times and service request statistics</translation>
+    </message>
+    <message>
+        <location filename="../TmsDiagnostics.py" line="29"/>
+        <source>Загрузка каталога</source>
+        <translation>Catalog loading</translation>
+    </message>
+    <message>
+        <location filename="../TmsDiagnostics.py" line="30"/>
+        <source>Построение дерева</source>
+        <translation>Tree building</translation>
+    </message>
+    <message>
+        <location filename="../TmsDiagnostics.py" line="31"/>
+        <source>Обновление каталога</source>
+        <translation>Catalog update</translation>
+    </message>
+    <message>
+        <location filename="../TmsDiagnostics.py" line="32"/>
+        <source>Открытие слоя</source>
+        <translation>Layer opening</translation>
+    </message>
+    <message>
+        <location filename="../TmsDiagnostics.py" line="33"/>
+        <source>Подготовка тайла</source>
+        <translation>Tile preparation</translation>
+    </message>
+    <message>
+        <location filename="../TmsDiagnostics.py" line="44"/>
+        <source>Сервис</source>
+        <translation>Service</translation>
+    </message>
+    <message>
+        <location filename="../TmsDiagnostics.py" line="44"/>
+        <source>Запросы</source>
+        <translation>Requests</translation>
+    </message>
+    <message>
+        <location filename="../TmsDiagnostics.py" line="44"/>
+        <source>Ошибки</source>
+        <translation>Errors</translation>
+    </message>
+    <message>
+        <location filename="../TmsDiagnostics.py" line="45"/>
+        <source>Объем</source>
+        <translation>Volume</translation>
+    </message>
+    <message>
+        <location filename="../TmsDiagnostics.py" line="45"/>
+        <source>Задержка p50, с</source>
+        <translation>Latency p50, s</translation>
+    </message>
+    <message>
+        <location filename="../TmsDiagnostics.py" line="46"/>
+        <source>Задержка p95, с</source>
+        <translation>Latency p95, s</translation>
+    </message>
+    <message>
+        <location filename="../TmsDiagnostics.py" line="46"/>
+        <source>Попадания в кэш</source>
+        <translation>Cache hits</translation>
+    </message>
+    <message>
+        <location filename="../TmsDiagnostics.py" line="53"/>
+        <source>Сохранить...</source>
+        <translation>Save...</translation>
+    </message>
+    <message>
+        <location filename="../TmsDiagnostics.py" line="56"/>
+        <source>Закрыть</source>
+        <translation>Close</translation>
+    </message>
+    <message>
+        <location filename="../TmsDiagnostics.py" line="30"/>
+        <source>с</source>
+        <translation>s</translation>
+    </message>
+    <message>
+        <location filename="../TmsDiagnostics.py" line="48"/>
+        <source>Дедупликация в кэше</source>
+        <translation>Cache dedup ratio</translation>
+    </message>
 </context>
 </TS>
@@ -0,0 +1,47 @@
+import http.server
+import threading
+
+import pytest
+
+
+PNG = (b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89'
+       b'\x00\x00\x00\rIDATx\x9cc\xf8\x0f\x00\x00\x01\x01\x00\x05\x18\xd8N\x00\x00\x00\x00IEND\xaeB`\x82')
+
+
+class StubServer:
+    """Tile server on the loopback interface: /<status>/... answers with that status, PNG tiles for 200."""
+
+    def __init__(self) -> None:
+        self.requests = []
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stub.requests.append(self.path)
+                status = int(self.path.split('/')[1])
+                body = PNG if status == 200 else b'unavailable'
+                self.send_response(status)
+                self.send_header('Content-Type', 'image/png' if status == 200 else 'text/plain')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.__server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}'.format(self.__server.server_address[1])
+        threading.Thread(target=self.__server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+
+@pytest.fixture
+def stub_server():
+    server = StubServer()
+    yield server
+    server.close()
@@ -0,0 +1,58 @@
+import sqlite3
+import time
+
+from com_github_kasim73_tile_services.core.TmsCache import TileCache
+
+
+def test_lru_eviction(tmp_path):
+    cache = TileCache(str(tmp_path / 'cache.mbtiles'), max_bytes=30)
+    for col in range(3):
+        cache.put('s', 1, 0, col, bytes([col]) * 10)
+        time.sleep(0.01)
+    # The oldest tile was read last, so the second one is evicted
+    assert cache.get('s', 1, 0, 0) is not None
+    cache.put('s', 1, 0, 3, b'x' * 10)
+    assert cache.contains('s', 1, 0, 0)
+    assert not cache.contains('s', 1, 0, 1)
+    assert cache.total_bytes == 30 and cache.evictions == 1
+    cache.close()
+
+
+def test_shared_payloads(tmp_path):
+    cache = TileCache(str(tmp_path / 'cache.mbtiles'))
+    cache.put('s', 1, 0, 0, b'sea')
+    cache.put('s', 1, 0, 1, b'sea')
+    assert cache.stats()['blobs'] == 1 and cache.total_bytes == 3
+    cache.remove_service('s')
+    assert cache.stats()['blobs'] == 0 and cache.total_bytes == 0
+    cache.close()
+
+
+def test_live_time(tmp_path):
+    file_name = str(tmp_path / 'cache.mbtiles')
+    cache = TileCache(file_name)
+    cache.set_live_time('s', 1)
+    cache.put('s', 1, 0, 0, b'tile')
+    assert cache.get('s', 1, 0, 0) == b'tile'
+    time.sleep(1.1)
+    assert not cache.contains('s', 1, 0, 0)
+    assert cache.get('s', 1, 0, 0) is None
+    # The expired tile is deleted without keeping the file locked
+    db = sqlite3.connect(file_name, timeout=0.5)
+    db.execute('DELETE FROM tiles')
+    db.commit()
+    db.close()
+    cache.close()
+
+
+def test_access_times_are_written_on_close(tmp_path):
+    file_name = str(tmp_path / 'cache.mbtiles')
+    cache = TileCache(file_name)
+    cache.put('s', 1, 0, 0, b'tile')
+    created = time.time()
+    time.sleep(0.01)
+    cache.get('s', 1, 0, 0)
+    cache.close()
+    db = sqlite3.connect(file_name)
+    assert db.execute('SELECT accessed FROM tiles').fetchone()[0] > created
+    db.close()
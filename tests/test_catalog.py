@@ -0,0 +1,76 @@
+import json
+import os
+
+from com_github_kasim73_tile_services.core.TmsCatalog import normalize_catalog, merge_catalogs, load_catalog
+from com_github_kasim73_tile_services.core.TmsSearch import SearchIndex
+
+
+def tms(name, title, description=None):
+    return {'name': name, 'title': title, 'description': description, 'url': 'http://example.com/{LEVEL}/{ROW}/{COL}'}
+
+
+def catalog(*categories):
+    # (category name, [(service name, title[, description])]) pairs
+    data = normalize_catalog({'services': {'category': [{'name': name, 'tms': [tms(*service) for service in services]}
+                                                        for name, services in categories]}})
+    assert not data['errors']
+    return data
+
+
+def services(merged):
+    return {cat['name']: [(data.name, data.title) for data in cat['services']] for cat in merged['categories']}
+
+
+def test_merge_replaces_in_place():
+    merged = merge_catalogs([catalog(('Osm', [('mapnik', 'Mapnik'), ('cycle', 'Cycle')])),
+                             catalog(('Osm', [('mapnik', 'Mapnik 2'), ('hot', 'Hot')]))])
+    assert services(merged) == {'Osm': [('mapnik', 'Mapnik 2'), ('cycle', 'Cycle'), ('hot', 'Hot')]}
+
+
+def test_merge_moves_across_categories():
+    merged = merge_catalogs([catalog(('Osm', [('mapnik', 'Mapnik')]), ('Esri', [('imagery', 'Imagery')])),
+                             catalog(('Mine', [('mapnik', 'Mapnik 2')]))])
+    # The category emptied by the move is dropped
+    assert services(merged) == {'Esri': [('imagery', 'Imagery')], 'Mine': [('mapnik', 'Mapnik 2')]}
+
+
+def test_snapshot_follows_content(tmp_path):
+    file_name = str(tmp_path / 'catalog.json')
+    snapshot = str(tmp_path / 'catalog.snapshot')
+
+    def write(title):
+        with open(file_name, 'w', encoding='UTF-8') as f:
+            json.dump({'services': {'category': [{'name': 'Osm', 'tms': [tms('mapnik', title)]}]}}, f)
+        os.utime(file_name, ns=(1, 1))
+
+    write('Mapnik 1')
+    assert services(load_catalog(file_name, snapshot)) == {'Osm': [('mapnik', 'Mapnik 1')]}
+    assert services(load_catalog(file_name, snapshot)) == {'Osm': [('mapnik', 'Mapnik 1')]}
+    # Same size and modification time
+    write('Mapnik 2')
+    assert services(load_catalog(file_name, snapshot)) == {'Osm': [('mapnik', 'Mapnik 2')]}
+
+
+def index(*categories):
+    search = SearchIndex()
+    search.build(catalog(*categories))
+    return search
+
+
+def test_search_ranking():
+    search = index(('Базовые', [('sat', 'Спутник', 'Снимки, карта не нужна'), ('cards', 'Картахена'),
+                                ('night', 'Ночная карта')]),
+                   ('Карты', [('osm', 'OpenStreetMap')]))
+    # A whole token beats a prefix, a title beats a category and a description
+    assert search.search('карта') == [('Базовые', 'night'), ('Базовые', 'cards'), ('Базовые', 'sat')]
+    found = search.search('карт')
+    assert set(found[:2]) == {('Базовые', 'cards'), ('Базовые', 'night')}
+    assert found[2:] == [('Карты', 'osm'), ('Базовые', 'sat')]
+    assert search.search('Ёж') == []
+
+
+def test_search_needs_every_term():
+    search = index(('Osm', [('mapnik', 'Mapnik'), ('cycle', 'Cycle map')]))
+    assert search.search('cycle map') == [('Osm', 'cycle')]
+    assert search.search('cycle mapnik') == []
+    assert search.search('  ') is None
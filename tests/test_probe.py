@@ -0,0 +1,41 @@
+import socket
+
+from com_github_kasim73_tile_services.core.TmsProbe import ServiceProbe
+from com_github_kasim73_tile_services.core.TmsService import Service
+
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_probe(stub_server):
+    services = [
+        Service('ok', stub_server.url + '/200/{LEVEL}/{ROW}/{COL}.png'),
+        Service('busy', stub_server.url + '/503/{LEVEL}/{ROW}/{COL}.png'),
+        Service('dead', 'http://127.0.0.1:{}/{{LEVEL}}/{{ROW}}/{{COL}}.png'.format(closed_port()))
+    ]
+    report = ServiceProbe(services, timeout=5).run()['services']
+
+    assert report['ok']['ok'] and report['ok']['available']
+    assert report['ok']['latency'] is not None
+    assert report['ok']['mirrors'][0]['status'] == 200
+
+    assert not report['busy']['available'] and report['busy']['latency'] is None
+    assert report['busy']['mirrors'][0]['status'] == 503
+
+    assert not report['dead']['available']
+    assert report['dead']['mirrors'][0]['status'] is None
+    assert report['dead']['mirrors'][0]['error']
+
+
+def test_probe_is_not_retried(stub_server):
+    ServiceProbe([Service('busy', stub_server.url + '/503/{LEVEL}/{ROW}/{COL}.png')], timeout=5).run()
+    assert len(stub_server.requests) == 1
+
+
+def test_probe_mirrors(stub_server):
+    report = ServiceProbe([Service('ok', stub_server.url + '/200/[ab]/{LEVEL}/{ROW}/{COL}.png')], timeout=5).run()
+    assert [r['mirror'] for r in report['services']['ok']['mirrors']] == ['a', 'b']
+    assert sorted(path.split('/')[2] for path in stub_server.requests) == ['a', 'b']
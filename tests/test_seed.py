@@ -0,0 +1,53 @@
+import sqlite3
+
+import pytest
+
+from com_github_kasim73_tile_services.core.TmsSeed import TileSeeder, MBTilesFile
+from com_github_kasim73_tile_services.core.TmsService import Service
+
+pytest.importorskip('numpy')
+
+BBOX = (37.5, 55.6, 37.8, 55.9)
+
+
+def test_seeding_resumes(stub_server, tmp_path):
+    data = Service('stub', stub_server.url + '/200/{LEVEL}/{ROW}/{COL}.png')
+    out = str(tmp_path / 'seed.mbtiles')
+    seeder = TileSeeder(data, out, workers=2)
+    count = seeder.count(BBOX, 8, 10)
+    assert seeder.run(BBOX, 8, 9) == (TileSeeder(data, out).count(BBOX, 8, 9), 0, 0)
+    requests = len(stub_server.requests)
+
+    # Only the tiles missing from the file are downloaded
+    downloaded, skipped, failed = TileSeeder(data, out, workers=2).run(BBOX, 8, 10)
+    assert (downloaded + skipped, skipped, failed) == (count, requests, 0)
+    assert len(stub_server.requests) == count
+
+    seeder = TileSeeder(data, out)
+    assert seeder.run(BBOX, 8, 10) == (0, count, 0)
+    assert seeder.stored == count and seeder.unique == 1
+
+
+def test_failed_tiles_are_downloaded_again(stub_server, tmp_path):
+    out = str(tmp_path / 'seed.mbtiles')
+    failing = Service('stub', stub_server.url + '/404/{LEVEL}/{ROW}/{COL}.png')
+    count = TileSeeder(failing, out).count(BBOX, 9, 9)
+    assert TileSeeder(failing, out).run(BBOX, 9, 9) == (0, 0, count)
+    working = Service('stub', stub_server.url + '/200/{LEVEL}/{ROW}/{COL}.png')
+    assert TileSeeder(working, out).run(BBOX, 9, 9) == (count, 0, 0)
+
+
+def test_replaced_tiles_leave_no_images(tmp_path):
+    file_name = str(tmp_path / 'out.mbtiles')
+    out = MBTilesFile(file_name, Service('s', 'http://example.com/{LEVEL}/{ROW}/{COL}'))
+    out.put(1, 0, 0, b'a')
+    out.put(1, 0, 1, b'a')
+    out.put(1, 1, 0, b'b')
+    out.put(1, 0, 0, b'c')
+    out.put(1, 1, 0, b'c')
+    assert out.dedup_stats() == (3, 2)
+    assert [out.get(1, 0, 0), out.get(1, 0, 1), out.get(1, 1, 0)] == [b'c', b'a', b'c']
+    out.close()
+    db = sqlite3.connect(file_name)
+    assert sorted(r[0] for r in db.execute('SELECT tile_data FROM images')) == [b'a', b'c']
+    db.close()
@@ -0,0 +1,33 @@
+import pytest
+
+from com_github_kasim73_tile_services.core.TmsService import Service
+from com_github_kasim73_tile_services.core.TmsUrl import UrlTemplate, mirrors, quadkey
+
+np = pytest.importorskip('numpy')
+
+
+@pytest.mark.parametrize('url, kind', [
+    ('http://t[0123].example.com/{LEVEL}/{ROW}/{COL}.png', 'xyz'),
+    ('http://ecn.t[0123].example.com/tiles/a{QUADKEY}.jpeg?g=1', 'quadkey'),
+    ('http://[ab].t[012].example.com/{COL}/{ROW}/{LEVEL}.png?{x}', 'xyz'),
+    ('http://example.com/{LEVEL}/{ROW}/{COL}', 'xyz'),
+])
+def test_urls_match_url(url, kind):
+    template = UrlTemplate(Service('test', url, kind))
+    xs, ys = np.meshgrid(np.arange(5, 13), np.arange(7, 16))
+    xs, ys = xs.ravel(), ys.ravel()
+    assert template.urls(4, xs, ys) == [template.url(4, x, y) for x, y in zip(xs.tolist(), ys.tolist())]
+
+
+def test_quadkey_urls():
+    template = UrlTemplate(Service('test', 'http://t[0123].example.com/{QUADKEY}', 'quadkey'))
+    assert template.urls(3, [3, 5], [5, 2]) == ['http://t0.example.com/' + quadkey(3, 3, 5),
+                                                 'http://t3.example.com/' + quadkey(3, 5, 2)]
+
+
+def test_mirror_groups_are_separate():
+    assert mirrors('http://[ab].t[012].example.com/') == ['a0', 'b1', 'a2']
+    assert mirrors('http://example.com/') == ['']
+    template = UrlTemplate(Service('test', 'http://[ab].t[012].example.com/{LEVEL}', 'xyz'))
+    assert template.url(1, 0, 0, 'b1') == 'http://b.t1.example.com/1'
+    assert template.url(1, 1, 1) == 'http://a.t2.example.com/1'